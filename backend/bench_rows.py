@@ -0,0 +1,67 @@
+# bench_rows.py - Memoria y tiempo por cada 100k filas según el formato de fila
+import gc
+import sys
+import time
+import tracemalloc
+
+from connection import Database
+from rows import InvoiceItem
+
+# Filas sintéticas con la forma de invoice_items (SELECT * en el orden de la tabla).
+# La query lleva parámetros: el módulo se escribe %% para que psycopg2 no lo tome como placeholder
+QUERY = """
+    SELECT
+        g::bigint as id,
+        (g / 5)::bigint as invoice_id,
+        (g %% 500)::bigint as product_id,
+        'PRODUCTO DE PRUEBA ' || (g %% 500) as description,
+        ((g %% 7) + 1)::decimal(10,3) as quantity,
+        'UNIDAD' as unit,
+        ((g %% 100) + 0.5)::decimal(10,2) as unit_price,
+        (g %% 3 <> 0) as has_igv,
+        ((g %% 700) + 0.9)::decimal(10,2) as total,
+        NOW() as created_at
+    FROM generate_series(1, %s) g
+"""
+
+FACTORIES = ["dict", "tuple", "namedtuple", InvoiceItem, "columnar"]
+
+
+def measure(db: Database, factory, rows: int) -> tuple:
+    """Retorna (segundos, MB retenidos por el resultado, MB pico)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = db.fetch_all(QUERY, (rows,), row_factory=factory)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = len(next(iter(result.values()))) if isinstance(result, dict) else len(result)
+    if count != rows:
+        # fetch_all retorna [] si la query falla: sin esto se medirían resultados vacíos
+        raise RuntimeError(f"Se esperaban {rows} filas y llegaron {count}: {db.last_error}")
+    del result
+    return elapsed, current / 1e6, peak / 1e6
+
+
+def run(rows: int = 100_000, repeat: int = 3):
+    db = Database()
+    if not db.connect():
+        return False
+
+    print(f"\n📊 Benchmark de formatos de fila ({rows:,} filas, mejor de {repeat})")
+    print("=" * 64)
+    print(f"{'formato':<14}{'tiempo (s)':>12}{'retenido (MB)':>16}{'pico (MB)':>12}")
+    scale = 100_000 / rows
+    for factory in FACTORIES:
+        best = min((measure(db, factory, rows) for _ in range(repeat)), key=lambda r: r[0])
+        name = factory if isinstance(factory, str) else factory.__name__
+        print(f"{name:<14}{best[0] * scale:>12.3f}{best[1] * scale:>16.1f}{best[2] * scale:>12.1f}")
+    print("=" * 64)
+    print("   Valores normalizados a 100k filas")
+    db.close()
+    return True
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
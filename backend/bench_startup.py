@@ -0,0 +1,88 @@
+# bench_startup.py - Tiempo de import y cold start de Repository (guardia contra regresiones)
+import subprocess
+import sys
+import time
+
+# Módulos pesados que no deben cargarse al importar repository
+FORBIDDEN_AT_IMPORT = ("cryptography", "crypto")
+
+IMPORT_PROBE = """
+import sys, time
+start = time.perf_counter()
+import repository
+import_ms = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+repo = repository.Repository()
+init_ms = (time.perf_counter() - start) * 1000
+loaded = [m for m in {forbidden!r} if m in sys.modules]
+connected = repo.db.conn is not None
+print(f"{{import_ms:.2f}} {{init_ms:.3f}} {{int(connected)}} {{','.join(loaded) or '-'}}")
+"""
+
+
+def probe() -> tuple:
+    """Proceso nuevo en cada corrida para medir en frío"""
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE.format(forbidden=FORBIDDEN_AT_IMPORT)],
+        capture_output=True, text=True, check=True,
+    ).stdout.strip().splitlines()[-1]
+    import_ms, init_ms, connected, loaded = out.split()
+    return float(import_ms), float(init_ms), connected == "1", [] if loaded == "-" else loaded.split(",")
+
+
+def first_query_ms() -> float:
+    """Cold start completo: import + Repository() + primera query (requiere BD)"""
+    start = time.perf_counter()
+    from repository import Repository
+    repo = Repository()
+    repo.get_products("0")
+    elapsed = (time.perf_counter() - start) * 1000
+    repo.close()
+    return elapsed
+
+
+def run(runs: int = 5, import_budget_ms: float = 150, init_budget_ms: float = 5,
+        with_db: bool = False) -> bool:
+    results = [probe() for _ in range(runs)]
+    import_ms = sorted(r[0] for r in results)[runs // 2]
+    init_ms = sorted(r[1] for r in results)[runs // 2]
+    connected = any(r[2] for r in results)
+    loaded = sorted({m for r in results for m in r[3]})
+
+    print(f"\n⏱️  Arranque de Repository (mediana de {runs} procesos)")
+    print("=" * 50)
+    print(f"   import repository: {import_ms:8.2f} ms (presupuesto {import_budget_ms} ms)")
+    print(f"   Repository():      {init_ms:8.3f} ms (presupuesto {init_budget_ms} ms)")
+    print(f"   Conectó en __init__: {'sí' if connected else 'no'}")
+    print(f"   Módulos pesados cargados: {', '.join(loaded) or 'ninguno'}")
+    if with_db:
+        print(f"   Primera query (cold start): {first_query_ms():8.1f} ms")
+    print("=" * 50)
+
+    failures = []
+    if import_ms > import_budget_ms:
+        failures.append("import fuera de presupuesto")
+    if init_ms > init_budget_ms:
+        failures.append("Repository() fuera de presupuesto")
+    if connected:
+        failures.append("Repository() conectó de forma eager")
+    if loaded:
+        failures.append(f"import cargó {', '.join(loaded)}")
+    for f in failures:
+        print(f"❌ {f}")
+    if not failures:
+        print("✅ Sin regresiones de arranque")
+    return not failures
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark de arranque de Repository")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=150)
+    parser.add_argument("--init-budget-ms", type=float, default=5)
+    parser.add_argument("--with-db", action="store_true", help="Medir también la primera query")
+    args = parser.parse_args()
+    if not run(args.runs, args.import_budget_ms, args.init_budget_ms, args.with_db):
+        raise SystemExit(1)
@@ -0,0 +1,192 @@
+# catalog_sync.py - Snapshot comprimido y delta-sync del catálogo (productos + clientes) para el cliente móvil
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Optional, Dict, List
+
+from repository import Repository
+
+SYNC_FORMAT_VERSION = 1
+# Margen al comparar updated_at: NOW() es el inicio de la transacción, no el commit
+WATERMARK_OVERLAP = timedelta(seconds=5)
+
+# Columnas compactas (nombres de types.ts) → columna en la BD
+PRODUCT_COLUMNS = [("id", "id"), ("description", "description"), ("unit", "unit"),
+                   ("basePrice", "base_price"), ("hasIgv", "has_igv"), ("stock", "stock")]
+CLIENT_COLUMNS = [("id", "id"), ("name", "name"), ("dni", "dni"), ("ruc", "ruc"), ("phone", "phone")]
+
+
+def _value(v):
+    if isinstance(v, datetime):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    return v
+
+
+def _table(rows: List[Dict], columns: list) -> Dict:
+    """Formato columnar: nombres una sola vez y filas como listas"""
+    return {
+        "columns": [name for name, _ in columns],
+        "rows": [[_value(r[col]) for _, col in columns] for r in rows],
+    }
+
+
+def _parse_watermark(value: str) -> Optional[datetime]:
+    """ISO 8601 con zona; sin zona se asume UTC. None si no se puede leer"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _encode(payload: Dict) -> bytes:
+    return gzip.compress(json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+
+def _response(status: int, etag: str, body: bytes = b"") -> Dict:
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "private, no-cache"}
+    if body:
+        headers.update({"Content-Type": "application/json", "Content-Encoding": "gzip"})
+    return {"status": status, "headers": headers, "body": body}
+
+
+class CatalogSync:
+    """
+    Sirve el catálogo de cada sender al cliente offline.
+
+    - `snapshot`: catálogo completo gzip + ETag; se cachea por sender y solo se
+      regenera si cambia el estado (conteos / últimos updated_at / tombstones).
+    - `delta`: altas y cambios desde un watermark más los borrados
+      (catalog_tombstones). Si el watermark es más viejo que la retención de
+      tombstones se responde un snapshot completo (`full: true`).
+
+    Estado y datos se leen del primario: con una réplica atrasada el watermark
+    (NOW() del primario) quedaría por delante de las filas servidas.
+    """
+
+    def __init__(self, repo: Repository = None, cache_size: int = 256, tombstone_retention_days: int = 30):
+        self.repo = repo or Repository()
+        self.cache_size = cache_size
+        self.tombstone_retention = timedelta(days=tombstone_retention_days)
+        self._cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ==================== CACHE ====================
+    def _cache_get(self, key: tuple, etag: str) -> Optional[bytes]:
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] == etag:
+                self._cache.move_to_end(key)
+                return cached[1]
+        return None
+
+    def _cache_put(self, key: tuple, etag: str, body: bytes):
+        with self._lock:
+            self._cache[key] = (etag, body)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, sender_id: str = None):
+        with self._lock:
+            for key in [k for k in self._cache if sender_id is None or k[0] == str(sender_id)]:
+                del self._cache[key]
+
+    # ==================== VERSIÓN ====================
+    def get_state(self, sender_id: str) -> tuple:
+        """(etag, watermark) del catálogo actual"""
+        state = self.repo.get_catalog_state(sender_id) or {}
+        fingerprint = "|".join(str(state.get(k)) for k in (
+            "products_count", "products_last", "clients_count", "clients_last", "tombstones_last"))
+        etag = hashlib.sha1(f"{SYNC_FORMAT_VERSION}|{sender_id}|{fingerprint}".encode()).hexdigest()[:20]
+        server_time = state.get("server_time")
+        return etag, server_time.isoformat() if server_time else None
+
+    # ==================== SNAPSHOT / DELTA ====================
+    def snapshot(self, sender_id: str, if_none_match: str = None) -> Dict:
+        """Catálogo completo (o 304 si el cliente ya tiene esta versión)"""
+        etag, watermark = self.get_state(sender_id)
+        if if_none_match and if_none_match.strip('"') == etag:
+            return _response(304, etag)
+
+        key = (str(sender_id), "snapshot")
+        body = self._cache_get(key, etag)
+        if body is None:
+            body = _encode({
+                "v": SYNC_FORMAT_VERSION,
+                "full": True,
+                "senderId": sender_id,
+                "watermark": watermark,
+                "products": _table(self.repo.get_products(sender_id, row_factory="dict", primary=True),
+                                   PRODUCT_COLUMNS),
+                "clients": _table(self.repo.get_clients(sender_id, row_factory="dict", primary=True),
+                                  CLIENT_COLUMNS),
+            })
+            self._cache_put(key, etag, body)
+        return _response(200, etag, body)
+
+    def delta(self, sender_id: str, since: str, if_none_match: str = None) -> Dict:
+        """Cambios desde `since` (watermark devuelto por el snapshot o delta anterior)"""
+        since_dt = _parse_watermark(since)
+        if since_dt is None:
+            return self.snapshot(sender_id, if_none_match)
+
+        etag, watermark = self.get_state(sender_id)
+        if if_none_match and if_none_match.strip('"') == etag:
+            return _response(304, etag)
+        if watermark and datetime.fromisoformat(watermark) - since_dt > self.tombstone_retention:
+            # Los tombstones de ese periodo ya se purgaron: el cliente debe rehacer todo
+            return self.snapshot(sender_id)
+
+        key = (str(sender_id), "delta", since)
+        body = self._cache_get(key, etag)
+        if body is None:
+            bound = (since_dt - WATERMARK_OVERLAP).isoformat()
+            tombstones = self.repo.get_tombstones(sender_id, bound, primary=True)
+            body = _encode({
+                "v": SYNC_FORMAT_VERSION,
+                "full": False,
+                "senderId": sender_id,
+                "since": since,
+                "watermark": watermark,
+                "products": _table(self.repo.get_products(sender_id, updated_since=bound, row_factory="dict",
+                                                          primary=True), PRODUCT_COLUMNS),
+                "clients": _table(self.repo.get_clients(sender_id, updated_since=bound, row_factory="dict",
+                                                        primary=True), CLIENT_COLUMNS),
+                "deleted": {
+                    "products": [t["row_id"] for t in tombstones if t["table_name"] == "products"],
+                    "clients": [t["row_id"] for t in tombstones if t["table_name"] == "clients"],
+                },
+            })
+            self._cache_put(key, etag, body)
+        return _response(200, etag, body)
+
+    def serve(self, sender_id: str, since: str = None, if_none_match: str = None) -> Dict:
+        """Punto de entrada para el endpoint HTTP: delta si hay watermark, si no snapshot"""
+        if since:
+            return self.delta(sender_id, since, if_none_match)
+        return self.snapshot(sender_id, if_none_match)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("❌ Uso: python catalog_sync.py <SENDER_ID> [WATERMARK]")
+        sys.exit(1)
+
+    sync = CatalogSync()
+    response = sync.serve(sys.argv[1], since=sys.argv[2] if len(sys.argv) > 2 else None)
+    payload = json.loads(gzip.decompress(response["body"])) if response["body"] else {}
+    print(f"📦 {response['status']} ETag={response['headers']['ETag']} · {len(response['body'])} bytes gzip")
+    print(f"   Productos: {len(payload.get('products', {}).get('rows', []))} · "
+          f"Clientes: {len(payload.get('clients', {}).get('rows', []))} · "
+          f"Borrados: {sum(len(v) for v in payload.get('deleted', {}).values())}")
+    print(f"   Watermark: {payload.get('watermark')}")
+    sync.repo.close()
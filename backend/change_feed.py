@@ -0,0 +1,229 @@
+# change_feed.py - Listener LISTEN/NOTIFY para cambios de comprobantes y catálogo (reemplaza el polling)
+import json
+import select
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Optional
+
+from connection import Database
+from create_triggers import NOTIFY_CHANNEL, NOTIFY_TABLES
+
+# Margen al ponerse al día: NOW() es el inicio de la transacción, no el commit
+CATCH_UP_OVERLAP = "5 seconds"
+CATCH_UP_LIMIT = 10000
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """
+    updated_at de un evento como datetime con zona.
+
+    El texto JSON del trigger usa el TimeZone de la sesión que escribió y recorta
+    los decimales, así que comparar strings no respeta el orden real.
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class ChangeFeed:
+    """
+    Reparte a los suscriptores los eventos que publica el trigger notify_change.
+
+    - Conexión dedicada en autocommit (no comparte la de Repository).
+    - Los eventos de una misma fila dentro de `coalesce_window` se fusionan
+      (gana el último), así una ráfaga de updates llega como un solo evento.
+    - Si hay más de `max_pending` filas pendientes el listener deja de leer
+      hasta que el dispatcher drene: la presión vuelve a la cola de Postgres.
+    - Al reconectar se pone al día consultando `updated_at` desde el último
+      evento visto. Los DELETE ocurridos durante la desconexión no se recuperan.
+    """
+
+    def __init__(self, dsn: str = None, coalesce_window: float = 0.05, max_pending: int = 10000,
+                 poll_timeout: float = 1.0, reconnect_delay: float = 1.0, max_reconnect_delay: float = 30.0):
+        self.dsn = dsn
+        self.coalesce_window = coalesce_window
+        self.max_pending = max_pending
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self._subscribers: Dict[int, tuple] = {}
+        self._next_token = 0
+        self._pending: Dict[tuple, Dict] = {}
+        self._cond = threading.Condition()
+        self._watermarks: Dict[str, datetime] = {}
+        self._running = False
+        self._threads = []
+        self.db: Optional[Database] = None
+
+    # ==================== SUSCRIPCIONES ====================
+    def subscribe(self, callback: Callable[[Dict], None], tables: Iterable[str] = None,
+                  sender_id=None) -> int:
+        """Registra un callback; filtra por tablas y/o sender. Retorna un token para desuscribirse"""
+        with self._cond:
+            self._next_token += 1
+            self._subscribers[self._next_token] = (
+                callback, set(tables) if tables else None, str(sender_id) if sender_id is not None else None
+            )
+            return self._next_token
+
+    def unsubscribe(self, token: int):
+        with self._cond:
+            self._subscribers.pop(token, None)
+
+    # ==================== CICLO DE VIDA ====================
+    def start(self):
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._listen_loop, name="change-feed-listener", daemon=True),
+            threading.Thread(target=self._dispatch_loop, name="change-feed-dispatcher", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=self.poll_timeout * 2)
+        if self.db:
+            self.db.close()
+
+    # ==================== LISTENER ====================
+    def _connect(self) -> bool:
+        self.db = Database(dsn=self.dsn)
+        if not self.db.connect():
+            return False
+        self.db.conn.autocommit = True
+        self.db.cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        return True
+
+    def _listen_loop(self):
+        delay = self.reconnect_delay
+        first = True
+        while self._running:
+            try:
+                if not self._connect():
+                    raise ConnectionError("No se pudo conectar el change feed")
+                if not first:
+                    self._catch_up()
+                first = False
+                delay = self.reconnect_delay
+                self._poll()
+            except Exception as e:
+                if not self._running:
+                    break
+                print(f"❌ Change feed desconectado: {e}. Reintentando en {delay:.0f}s")
+                if self.db:
+                    try:
+                        self.db.close()
+                    except Exception:
+                        pass
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _poll(self):
+        conn = self.db.conn
+        while self._running:
+            if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    self._enqueue(json.loads(notify.payload))
+                except ValueError:
+                    print(f"⚠️  Payload inválido en {NOTIFY_CHANNEL}: {notify.payload[:100]}")
+
+    def _enqueue(self, event: Dict):
+        with self._cond:
+            # Backpressure: no leer más notificaciones mientras haya demasiadas pendientes
+            while len(self._pending) >= self.max_pending and self._running:
+                self._cond.wait(self.poll_timeout)
+            self._pending[(event["table"], event["id"])] = event
+            updated_at = _parse_timestamp(event.get("updated_at"))
+            if updated_at and (event["table"] not in self._watermarks
+                               or updated_at > self._watermarks[event["table"]]):
+                self._watermarks[event["table"]] = updated_at
+            self._cond.notify_all()
+
+    def _catch_up(self):
+        """Re-emite como UPDATE las filas modificadas desde el último evento visto"""
+        for table in NOTIFY_TABLES:
+            since = self._watermarks.get(table)
+            if not since:
+                continue
+            status = ", status" if table == "invoices" else ""
+            select = f"SELECT id, sender_id, updated_at{status} FROM {table}"
+            rows = self.db.fetch_all(f"""
+                {select}
+                WHERE updated_at > %s::timestamptz - INTERVAL '{CATCH_UP_OVERLAP}'
+                ORDER BY updated_at, id
+                LIMIT {CATCH_UP_LIMIT}
+            """, (since,), row_factory="dict")
+            recovered = 0
+            while rows:
+                for row in rows:
+                    event = {"table": table, "op": "UPDATE", "catch_up": True, **row}
+                    event["updated_at"] = row["updated_at"].isoformat()
+                    self._enqueue(event)
+                recovered += len(rows)
+                if len(rows) < CATCH_UP_LIMIT:
+                    break
+                # Paginación por (updated_at, id): el watermark avanza con cada página
+                last = rows[-1]
+                rows = self.db.fetch_all(f"""
+                    {select}
+                    WHERE (updated_at, id) > (%s, %s)
+                    ORDER BY updated_at, id
+                    LIMIT {CATCH_UP_LIMIT}
+                """, (last["updated_at"], last["id"]), row_factory="dict")
+            if recovered:
+                print(f"🔄 Change feed: {recovered} cambios recuperados en {table}")
+
+    # ==================== DISPATCHER ====================
+    def _dispatch_loop(self):
+        while self._running:
+            with self._cond:
+                while not self._pending and self._running:
+                    self._cond.wait(self.poll_timeout)
+            # Ventana de coalescencia: juntar la ráfaga antes de repartir
+            time.sleep(self.coalesce_window)
+            with self._cond:
+                batch, self._pending = list(self._pending.values()), {}
+                subscribers = list(self._subscribers.values())
+                self._cond.notify_all()
+            for event in batch:
+                self._deliver(event, subscribers)
+
+    @staticmethod
+    def _deliver(event: Dict, subscribers: list):
+        for callback, tables, sender_id in subscribers:
+            if tables and event["table"] not in tables:
+                continue
+            if sender_id and str(event.get("sender_id")) != sender_id:
+                continue
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"❌ Error en suscriptor del change feed: {e}")
+
+
+if __name__ == "__main__":
+    feed = ChangeFeed()
+    feed.subscribe(lambda e: print(f"📣 {e['table']} {e['op']} id={e['id']} sender={e.get('sender_id')}"
+                                   f"{' status=' + e['status'] if e.get('status') else ''}"))
+    feed.start()
+    print(f"👂 Escuchando {NOTIFY_CHANNEL} (Ctrl+C para salir)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        feed.stop()
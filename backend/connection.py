@@ -1,23 +1,75 @@
 # connection.py - Conexión a Supabase PostgreSQL
+import time
+from contextlib import contextmanager
+
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR
+from psycopg2.extras import RealDictCursor, NamedTupleCursor, execute_batch
 from config import SUPABASE_CONFIG
+from rows import row_builder, to_columns
+
+# Formatos de fila soportados además de una clase de rows.py
+ROW_FACTORIES = ("dict", "tuple", "namedtuple", "columnar")
+
+# Lag de la réplica en segundos (0 si ya reprodujo todo lo recibido o si no es standby)
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+    END as lag
+"""
+
 
 class Database:
-    def __init__(self):
+    def __init__(self, row_factory="dict", dsn: str = None, replica_dsn: str = None,
+                 max_replica_lag: float = 5.0, read_your_writes: float = 2.0,
+                 lag_check_interval: float = 5.0, replica_retry: float = 30.0):
+        """
+        Args:
+            row_factory: Formato de fila por defecto: 'dict' (RealDictCursor),
+                'tuple', 'namedtuple' o 'columnar'. Una dataclass de rows.py solo
+                se acepta por llamada (fetch_all(..., row_factory=Product)): como
+                default se aplicaría a todas las tablas y descartaría columnas
+            dsn: Connection string alternativa (ej. Postgres local); por defecto SUPABASE_CONFIG
+            replica_dsn: Réplica de lectura opcional para fetch_all / fetch_one
+            max_replica_lag: Segundos de lag tolerados antes de leer del primario
+            read_your_writes: Segundos después de una escritura en que se lee del primario
+            lag_check_interval: Cada cuántos segundos se vuelve a medir el lag
+            replica_retry: Segundos antes de reintentar una réplica caída
+        """
+        if row_factory not in ROW_FACTORIES:
+            raise ValueError(f"row_factory no soportado como default: {row_factory}")
         self.conn = None
         self.cursor = None
+        self.row_factory = row_factory
+        self.dsn = dsn
+        self.last_error = None
+        self._tx_depth = 0
+
+        self.replica = Database(row_factory, replica_dsn) if replica_dsn else None
+        self.max_replica_lag = max_replica_lag
+        self.read_your_writes = read_your_writes
+        self.lag_check_interval = lag_check_interval
+        self.replica_retry = replica_retry
+        self._last_write = float("-inf")
+        self._replica_down_until = 0.0
+        self._replica_lag = 0.0
+        self._lag_checked_at = float("-inf")
 
     def connect(self):
         """Establece conexión con Supabase PostgreSQL"""
         try:
-            self.conn = psycopg2.connect(
-                host=SUPABASE_CONFIG["host"],
-                port=SUPABASE_CONFIG["port"],
-                database=SUPABASE_CONFIG["database"],
-                user=SUPABASE_CONFIG["user"],
-                password=SUPABASE_CONFIG["password"]
-            )
+            if self.dsn:
+                self.conn = psycopg2.connect(self.dsn)
+            else:
+                self.conn = psycopg2.connect(
+                    host=SUPABASE_CONFIG["host"],
+                    port=SUPABASE_CONFIG["port"],
+                    database=SUPABASE_CONFIG["database"],
+                    user=SUPABASE_CONFIG["user"],
+                    password=SUPABASE_CONFIG["password"]
+                )
             self.cursor = self.conn.cursor(cursor_factory=RealDictCursor)
             print("✅ Conexión exitosa a Supabase!")
             return True
@@ -25,33 +77,199 @@ class Database:
             print(f"❌ Error de conexión: {e}")
             return False
 
+    def ensure_connected(self) -> bool:
+        """Conexión perezosa: se abre recién en la primera query"""
+        return self.conn is not None or self.connect()
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._tx_depth > 0
+
+    @contextmanager
+    def transaction(self):
+        """
+        Agrupa varias escrituras en un solo commit.
+
+        Los bloques anidados usan SAVEPOINT: un error dentro de un bloque interno
+        solo deshace ese bloque. Dentro de una transacción `execute` y los
+        `fetch_*` lanzan la excepción en vez de retornar False / vacío, para que
+        el bloque haga rollback. Si aun así la transacción quedó abortada (error
+        atrapado por el llamador) se deshace y se lanza en vez de hacer commit.
+        """
+        if not self.ensure_connected():
+            raise ConnectionError("No hay conexión a la base de datos")
+        savepoint = f"sp_{self._tx_depth}" if self._tx_depth else None
+        if savepoint:
+            self.cursor.execute(f"SAVEPOINT {savepoint}")
+        self._tx_depth += 1
+        try:
+            yield self
+        except Exception:
+            self._tx_depth -= 1
+            if savepoint:
+                self.cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+            else:
+                self.conn.rollback()
+            raise
+        else:
+            self._tx_depth -= 1
+            if self.conn.get_transaction_status() == TRANSACTION_STATUS_INERROR:
+                if savepoint:
+                    self.cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                else:
+                    self.conn.rollback()
+                raise psycopg2.InternalError(
+                    f"Transacción abortada por un error anterior: {self.last_error}")
+            if savepoint:
+                self.cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+            else:
+                self.conn.commit()
+
     def execute(self, query, params=None):
-        """Ejecuta una query"""
+        """Ejecuta una query (commit inmediato fuera de una transacción)"""
+        if not self.ensure_connected():
+            return False
         try:
             self.cursor.execute(query, params)
-            self.conn.commit()
+            self._last_write = time.monotonic()
+            if not self.in_transaction:
+                self.conn.commit()
             return True
         except Exception as e:
             print(f"❌ Error ejecutando query: {e}")
+            self.last_error = e
+            if self.in_transaction:
+                raise
             self.conn.rollback()
             return False
 
-    def fetch_all(self, query, params=None):
-        """Ejecuta SELECT y retorna todos los resultados"""
+    def execute_returning(self, query, params=None):
+        """Ejecuta un INSERT/UPDATE ... RETURNING y retorna la fila (None si falla)"""
+        if not self.ensure_connected():
+            return None
         try:
             self.cursor.execute(query, params)
-            return self.cursor.fetchall()
+            row = self.cursor.fetchone()
+            self._last_write = time.monotonic()
+            if not self.in_transaction:
+                self.conn.commit()
+            return row
+        except Exception as e:
+            print(f"❌ Error ejecutando query: {e}")
+            self.last_error = e
+            if self.in_transaction:
+                raise
+            self.conn.rollback()
+            return None
+
+    def execute_many(self, query, params_list, page_size=100):
+        """Ejecuta la misma query para muchos parámetros en lotes (un round trip por página)"""
+        if not self.ensure_connected():
+            return False
+        try:
+            execute_batch(self.cursor, query, params_list, page_size=page_size)
+            self._last_write = time.monotonic()
+            if not self.in_transaction:
+                self.conn.commit()
+            return True
+        except Exception as e:
+            print(f"❌ Error ejecutando lote: {e}")
+            self.last_error = e
+            if self.in_transaction:
+                raise
+            self.conn.rollback()
+            return False
+
+    def _fetch(self, query, params, row_factory, one):
+        """Ejecuta un SELECT con un cursor del formato pedido"""
+        factory = row_factory or self.row_factory
+        if factory == "dict":
+            self.cursor.execute(query, params)
+            return self.cursor.fetchone() if one else self.cursor.fetchall()
+
+        cursor_factory = NamedTupleCursor if factory == "namedtuple" else None
+        with self.conn.cursor(cursor_factory=cursor_factory) as cur:
+            cur.execute(query, params)
+            rows = [cur.fetchone()] if one else cur.fetchall()
+            if one and rows[0] is None:
+                return None
+            columns = [d.name for d in cur.description]
+
+        if factory in ("tuple", "namedtuple"):
+            result = rows
+        elif factory == "columnar":
+            return to_columns(columns, rows)
+        else:
+            build = row_builder(factory, columns)
+            result = [build(row) for row in rows]
+        return result[0] if one else result
+
+    # ==================== RÉPLICA DE LECTURA ====================
+    def _mark_replica_down(self, error):
+        print(f"⚠️  Réplica no disponible, leyendo del primario: {error}")
+        self._replica_down_until = time.monotonic() + self.replica_retry
+        try:
+            self.replica.close()
+        except Exception:
+            pass
+        self.replica.conn = self.replica.cursor = None
+
+    def _use_replica(self, primary) -> bool:
+        """Decide si un SELECT puede ir a la réplica"""
+        if primary or self.replica is None or self.in_transaction:
+            return False
+        now = time.monotonic()
+        if now - self._last_write < self.read_your_writes or now < self._replica_down_until:
+            return False
+        if not self.replica.ensure_connected():
+            self._replica_down_until = now + self.replica_retry
+            return False
+        self.replica.conn.autocommit = True
+        if now - self._lag_checked_at > self.lag_check_interval:
+            try:
+                self._replica_lag = float(self.replica._fetch(REPLICA_LAG_QUERY, None, "dict", one=True)["lag"])
+                self._lag_checked_at = now
+            except Exception as e:
+                self._mark_replica_down(e)
+                return False
+        return self._replica_lag <= self.max_replica_lag
+
+    def _read(self, query, params, row_factory, one, primary):
+        if self._use_replica(primary):
+            try:
+                return self.replica._fetch(query, params, row_factory or self.row_factory, one)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                self._mark_replica_down(e)
+        if not self.ensure_connected():
+            raise ConnectionError("No hay conexión a la base de datos")
+        try:
+            return self._fetch(query, params, row_factory, one)
+        except Exception as e:
+            self.last_error = e
+            # Fuera de una transacción se deshace aquí: si no, la conexión (que vive
+            # lo mismo que el Repository) respondería "current transaction is aborted"
+            if not self.in_transaction and not self.conn.closed:
+                self.conn.rollback()
+            raise
+
+    def fetch_all(self, query, params=None, row_factory=None, primary=None):
+        """Ejecuta SELECT y retorna todos los resultados (primary=True fuerza el primario)"""
+        try:
+            return self._read(query, params, row_factory, False, primary)
         except Exception as e:
             print(f"❌ Error en fetch: {e}")
+            if self.in_transaction:
+                raise
             return []
 
-    def fetch_one(self, query, params=None):
-        """Ejecuta SELECT y retorna un resultado"""
+    def fetch_one(self, query, params=None, row_factory=None, primary=None):
+        """Ejecuta SELECT y retorna un resultado (primary=True fuerza el primario)"""
         try:
-            self.cursor.execute(query, params)
-            return self.cursor.fetchone()
+            return self._read(query, params, row_factory, True, primary)
         except Exception as e:
             print(f"❌ Error en fetch: {e}")
+            if self.in_transaction:
+                raise
             return None
 
     def close(self):
@@ -61,6 +279,8 @@ class Database:
         if self.conn:
             self.conn.close()
             print("🔌 Conexión cerrada")
+        if self.replica:
+            self.replica.close()
 
 
 # Test de conexión
@@ -2,6 +2,7 @@
 from connection import Database
 
 DROP_TABLES = """
+DROP TABLE IF EXISTS catalog_tombstones CASCADE;
 DROP TABLE IF EXISTS invoice_items CASCADE;
 DROP TABLE IF EXISTS invoices CASCADE;
 DROP TABLE IF EXISTS products CASCADE;
@@ -33,10 +34,14 @@ CREATE TABLE IF NOT EXISTS senders (
     ruc VARCHAR(11) NOT NULL UNIQUE,
     sunat_user_encrypted TEXT,
     sunat_pass_encrypted TEXT,
+    deleting_at TIMESTAMP WITH TIME ZONE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Migración: marca de borrado en curso (purge.py)
+ALTER TABLE senders ADD COLUMN IF NOT EXISTS deleting_at TIMESTAMP WITH TIME ZONE;
+
 -- Tabla: clients (Clientes)
 CREATE TABLE IF NOT EXISTS clients (
     id BIGSERIAL PRIMARY KEY,
@@ -102,13 +107,24 @@ CREATE TABLE IF NOT EXISTS invoice_items (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Tabla: catalog_tombstones (Borrados de productos/clientes para el delta-sync móvil)
+CREATE TABLE IF NOT EXISTS catalog_tombstones (
+    id BIGSERIAL PRIMARY KEY,
+    sender_id BIGINT NOT NULL,
+    table_name VARCHAR(20) NOT NULL CHECK (table_name IN ('products', 'clients')),
+    row_id BIGINT NOT NULL,
+    deleted_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
 -- ÍNDICES
 CREATE INDEX IF NOT EXISTS idx_senders_user ON senders(user_id);
 CREATE INDEX IF NOT EXISTS idx_clients_sender ON clients(sender_id);
 CREATE INDEX IF NOT EXISTS idx_products_sender ON products(sender_id);
 CREATE INDEX IF NOT EXISTS idx_invoices_sender ON invoices(sender_id);
 CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices(date DESC);
+CREATE INDEX IF NOT EXISTS idx_invoices_referenced ON invoices(referenced_invoice_id) WHERE referenced_invoice_id IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice ON invoice_items(invoice_id);
+CREATE INDEX IF NOT EXISTS idx_catalog_tombstones_sender ON catalog_tombstones(sender_id, deleted_at);
 
 -- =============================================
 -- FUNCIÓN: Verificar si usuario es admin
@@ -132,6 +148,7 @@ ALTER TABLE clients ENABLE ROW LEVEL SECURITY;
 ALTER TABLE products ENABLE ROW LEVEL SECURITY;
 ALTER TABLE invoices ENABLE ROW LEVEL SECURITY;
 ALTER TABLE invoice_items ENABLE ROW LEVEL SECURITY;
+ALTER TABLE catalog_tombstones ENABLE ROW LEVEL SECURITY;
 
 -- Políticas user_profiles
 DROP POLICY IF EXISTS "Users can view own profile" ON user_profiles;
@@ -179,6 +196,12 @@ DROP POLICY IF EXISTS "Admins can manage all invoice_items" ON invoice_items;
 CREATE POLICY "Users can manage invoice_items" ON invoice_items FOR ALL USING (invoice_id IN (SELECT i.id FROM invoices i JOIN senders s ON i.sender_id = s.id WHERE s.user_id = auth.uid()));
 CREATE POLICY "Admins can manage all invoice_items" ON invoice_items FOR ALL USING (is_admin());
 
+-- Políticas catalog_tombstones (solo lectura para la empresa)
+DROP POLICY IF EXISTS "Users can view tombstones" ON catalog_tombstones;
+DROP POLICY IF EXISTS "Admins can manage all tombstones" ON catalog_tombstones;
+CREATE POLICY "Users can view tombstones" ON catalog_tombstones FOR SELECT USING (sender_id IN (SELECT id FROM senders WHERE user_id = auth.uid()));
+CREATE POLICY "Admins can manage all tombstones" ON catalog_tombstones FOR ALL USING (is_admin());
+
 -- =============================================
 -- TRIGGER: Crear perfil automáticamente al registrarse
 -- =============================================
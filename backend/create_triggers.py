@@ -1,6 +1,52 @@
 # fix_triggers.py - Crear función y triggers para updated_at automático
 from connection import Database
 
+NOTIFY_CHANNEL = 'factumovil_changes'
+NOTIFY_TABLES = ['invoices', 'products', 'clients']
+
+# Payload mínimo (< 8000 bytes): tabla, operación, id, sender, updated_at y status si aplica
+NOTIFY_FUNC_SQL = f"""
+CREATE OR REPLACE FUNCTION notify_change()
+RETURNS TRIGGER AS $body$
+DECLARE
+    rec RECORD;
+    payload JSONB;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        rec := OLD;
+    ELSE
+        rec := NEW;
+    END IF;
+    payload := jsonb_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'id', rec.id,
+        'sender_id', rec.sender_id,
+        'updated_at', rec.updated_at
+    );
+    IF TG_NARGS > 0 AND TG_ARGV[0] = 'status' THEN
+        payload := payload || jsonb_build_object('status', rec.status);
+    END IF;
+    PERFORM pg_notify('{NOTIFY_CHANNEL}', payload::text);
+    RETURN NULL;
+END;
+$body$ language plpgsql;
+"""
+
+TOMBSTONE_TABLES = ['products', 'clients']
+
+# Registra los borrados del catálogo para que el delta-sync pueda propagarlos
+TOMBSTONE_FUNC_SQL = """
+CREATE OR REPLACE FUNCTION record_tombstone()
+RETURNS TRIGGER AS $body$
+BEGIN
+    INSERT INTO catalog_tombstones (sender_id, table_name, row_id)
+    VALUES (OLD.sender_id, TG_TABLE_NAME, OLD.id);
+    RETURN NULL;
+END;
+$body$ language plpgsql SECURITY DEFINER;
+"""
+
 
 def create_triggers():
     """Crea la función y triggers para auto-update de updated_at"""
@@ -39,6 +85,39 @@ def create_triggers():
         db.conn.commit()
         print(f"✅ Trigger {trigger_name}")
 
+    # Change feed: NOTIFY compacto en cada cambio de comprobantes y catálogo
+    db.cursor.execute(NOTIFY_FUNC_SQL)
+    db.conn.commit()
+    print("✅ Función notify_change creada")
+
+    for table in NOTIFY_TABLES:
+        trigger_name = f'notify_{table}_change'
+        extra = "'status'" if table == 'invoices' else ''
+        db.cursor.execute(f'DROP TRIGGER IF EXISTS {trigger_name} ON {table};')
+        db.cursor.execute(f'''
+            CREATE TRIGGER {trigger_name}
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION notify_change({extra});
+        ''')
+        db.conn.commit()
+        print(f"✅ Trigger {trigger_name}")
+
+    # Tombstones del catálogo (delta-sync)
+    db.cursor.execute(TOMBSTONE_FUNC_SQL)
+    db.conn.commit()
+    print("✅ Función record_tombstone creada")
+
+    for table in TOMBSTONE_TABLES:
+        trigger_name = f'tombstone_{table}'
+        db.cursor.execute(f'DROP TRIGGER IF EXISTS {trigger_name} ON {table};')
+        db.cursor.execute(f'''
+            CREATE TRIGGER {trigger_name}
+            AFTER DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION record_tombstone();
+        ''')
+        db.conn.commit()
+        print(f"✅ Trigger {trigger_name}")
+
     print("=" * 50)
     db.close()
     print("\n🎉 Triggers configurados correctamente!")
@@ -1,18 +1,40 @@
 # crypto.py - Encriptación AES-256 para datos sensibles (credenciales SUNAT)
+#
+# Formatos:
+#   fernet → salt factumovil_salt_v1 (formato histórico del backend)
+#   aesgcm → salt factumovil-salt-v1, IV 12 bytes + datos, Base64 (el del frontend)
+# decrypt acepta ambos, así que el backend sigue leyendo durante y después de
+# migrate_credentials.py. Orden de la migración:
+#   1. Desplegar con FACTUMOVIL_NEW_ENCRYPTION_KEY (+ FACTUMOVIL_NEW_ENCRYPTION_FORMAT, por
+#      defecto aesgcm): desde ahí encrypt ya escribe con la clave y formato destino
+#   2. Correr migrate_credentials.py y volver a correrlo al terminar: el cursor solo ve
+#      las filas de su snapshot inicial y el frontend puede haber escrito con su clave
+#   3. Pasar la clave destino a FACTUMOVIL_ENCRYPTION_KEY, el formato a
+#      FACTUMOVIL_ENCRYPTION_FORMAT y quitar las variables NEW
 import base64
 import os
-from cryptography.fernet import Fernet
+from functools import lru_cache
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 # La clave maestra debe estar en variable de entorno
 # Genera una con: python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
 ENCRYPTION_KEY = os.environ.get('FACTUMOVIL_ENCRYPTION_KEY', 'CAMBIAR_EN_PRODUCCION')
+# Formato con el que encrypt escribe: 'fernet' o 'aesgcm'
+ENCRYPTION_FORMAT = os.environ.get('FACTUMOVIL_ENCRYPTION_FORMAT', 'fernet')
+# Clave y formato destino de una migración en curso: si están, encrypt ya los usa
+NEW_ENCRYPTION_KEY = os.environ.get('FACTUMOVIL_NEW_ENCRYPTION_KEY')
+NEW_ENCRYPTION_FORMAT = os.environ.get('FACTUMOVIL_NEW_ENCRYPTION_FORMAT', 'aesgcm')
+# Todo token Fernet empieza con el byte de versión 0x80
+FERNET_PREFIX = 'gAAAAA'
 
 
-def _get_fernet():
-    """Deriva una clave Fernet desde la clave maestra"""
-    if ENCRYPTION_KEY == 'CAMBIAR_EN_PRODUCCION':
+@lru_cache(maxsize=4)
+def _derive_fernet(master_key: str) -> Fernet:
+    """PBKDF2 (100k iteraciones) una sola vez por clave maestra"""
+    if master_key == 'CAMBIAR_EN_PRODUCCION':
         print("⚠️  ADVERTENCIA: Usando clave de encriptación por defecto. Configura FACTUMOVIL_ENCRYPTION_KEY")
     
     # Derivar clave usando PBKDF2
@@ -22,26 +44,64 @@ def _get_fernet():
         salt=b'factumovil_salt_v1',  # Salt fijo para poder desencriptar
         iterations=100000,
     )
-    key = base64.urlsafe_b64encode(kdf.derive(ENCRYPTION_KEY.encode()))
+    key = base64.urlsafe_b64encode(kdf.derive(master_key.encode()))
     return Fernet(key)
 
 
+@lru_cache(maxsize=4)
+def _derive_aesgcm(master_key: str) -> AESGCM:
+    """Misma derivación que el frontend y crypto_decrypt.py"""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=b'factumovil-salt-v1',
+        iterations=100000,
+    )
+    return AESGCM(kdf.derive(master_key.encode()))
+
+
+def _get_fernet():
+    """Deriva una clave Fernet desde la clave maestra"""
+    return _derive_fernet(ENCRYPTION_KEY)
+
+
+def _decrypt_fernet(master_key: str, encrypted_text: str) -> str:
+    return _derive_fernet(master_key).decrypt(encrypted_text.encode()).decode()
+
+
+def _decrypt_aesgcm(master_key: str, encrypted_text: str) -> str:
+    combined = base64.b64decode(encrypted_text)
+    return _derive_aesgcm(master_key).decrypt(combined[:12], combined[12:], None).decode('utf-8')
+
+
 def encrypt(plain_text: str) -> str:
-    """Encripta texto plano → string base64"""
+    """Encripta texto plano → string base64 (clave y formato destino si hay una migración en curso)"""
     if not plain_text:
         return None
-    f = _get_fernet()
-    encrypted = f.encrypt(plain_text.encode())
+    key, fmt = (NEW_ENCRYPTION_KEY, NEW_ENCRYPTION_FORMAT) if NEW_ENCRYPTION_KEY else (ENCRYPTION_KEY, ENCRYPTION_FORMAT)
+    if fmt == 'aesgcm':
+        iv = os.urandom(12)
+        encrypted = _derive_aesgcm(key).encrypt(iv, plain_text.encode('utf-8'), None)
+        return base64.b64encode(iv + encrypted).decode()
+    encrypted = _derive_fernet(key).encrypt(plain_text.encode())
     return encrypted.decode()
 
 
 def decrypt(encrypted_text: str) -> str:
-    """Desencripta string base64 → texto plano"""
+    """Desencripta string base64 → texto plano (Fernet o AES-GCM, clave actual o nueva)"""
     if not encrypted_text:
         return None
-    f = _get_fernet()
-    decrypted = f.decrypt(encrypted_text.encode())
-    return decrypted.decode()
+    decoders = [_decrypt_fernet, _decrypt_aesgcm]
+    if not encrypted_text.startswith(FERNET_PREFIX):
+        decoders.reverse()
+    keys = [ENCRYPTION_KEY] + ([NEW_ENCRYPTION_KEY] if NEW_ENCRYPTION_KEY else [])
+    for decoder in decoders:
+        for key in keys:
+            try:
+                return decoder(key, encrypted_text)
+            except Exception:
+                continue
+    raise InvalidToken
 
 
 # Test
@@ -0,0 +1,209 @@
+# export.py - Exportación del registro de ventas (CSV / PLE 14.1) en streaming con COPY TO STDOUT
+import gzip
+import calendar
+from typing import Optional
+
+from connection import Database
+
+COPY_BUFFER_SIZE = 1 << 16
+
+# Estados que forman parte del registro de ventas
+REGISTER_STATUSES = ("ACEPTADO", "ANULADO")
+
+# Tabla 10 SUNAT: tipo de comprobante
+PLE_DOC_TYPE_SQL = "CASE {a}.type WHEN 'FACTURA' THEN '01' WHEN 'BOLETA' THEN '03' WHEN 'NOTA_CREDITO' THEN '07' END"
+
+# Tabla 2 SUNAT: tipo de documento de identidad (RUC = 6, DNI = 1, sin documento = 0)
+PLE_ID_TYPE_SQL = "CASE LENGTH(COALESCE(i.client_document, '')) WHEN 11 THEN '6' WHEN 8 THEN '1' ELSE '0' END"
+
+# Las notas de crédito restan en el registro; los anulados (estado 2) van con importes en cero
+SIGN_SQL = "(CASE WHEN i.status = 'ANULADO' THEN 0 WHEN i.type = 'NOTA_CREDITO' THEN -1 ELSE 1 END)"
+
+CSV_COLUMNS = """
+    i.id, i.date, i.type, i.series, i.number, i.client_name, i.client_document,
+    i.subtotal, i.igv, i.total, i.status,
+    r.series as ref_series, r.number as ref_number, r.date as ref_date, i.credit_note_reason
+"""
+
+CSV_ITEM_COLUMNS = """,
+    ii.product_id, ii.description as item_description, ii.quantity, ii.unit,
+    ii.unit_price, ii.has_igv, ii.total as item_total
+"""
+
+# Una línea por comprobante en el orden de campos del formato 14.1 (Registro de Ventas e Ingresos)
+PLE_LINE_SQL = f"""
+    concat_ws('|',
+        %(period)s,
+        i.id,
+        'M' || i.id,
+        TO_CHAR(i.date, 'DD/MM/YYYY'),
+        '',
+        {PLE_DOC_TYPE_SQL.format(a='i')},
+        i.series,
+        i.number,
+        '',
+        {PLE_ID_TYPE_SQL},
+        COALESCE(i.client_document, ''),
+        COALESCE(i.client_name, ''),
+        '0.00',
+        TO_CHAR({SIGN_SQL} * CASE WHEN it IS NULL THEN i.subtotal ELSE COALESCE(it.gravada, 0) END, 'FM9999999990.00'),
+        '0.00',
+        TO_CHAR({SIGN_SQL} * i.igv, 'FM9999999990.00'),
+        '0.00',
+        TO_CHAR({SIGN_SQL} * CASE WHEN it IS NULL THEN 0 ELSE COALESCE(it.exonerada, 0) END, 'FM9999999990.00'),
+        '0.00', '0.00', '0.00', '0.00', '0.00', '0.00',
+        TO_CHAR({SIGN_SQL} * i.total, 'FM9999999990.00'),
+        'PEN',
+        '1.000',
+        COALESCE(TO_CHAR(r.date, 'DD/MM/YYYY'), ''),
+        COALESCE({PLE_DOC_TYPE_SQL.format(a='r')}, ''),
+        COALESCE(r.series, ''),
+        COALESCE(r.number, ''),
+        '', '', '',
+        CASE WHEN i.status = 'ANULADO' THEN '2' ELSE '1' END
+    ) || '|'
+"""
+
+# Separación gravada / exonerada a partir del detalle (sin IGV). Sin items (it IS NULL)
+# todo el subtotal se toma como gravado; con items, una parte vacía vale 0
+ITEMS_SPLIT_SQL = """
+    LEFT JOIN LATERAL (
+        SELECT
+            SUM(ii.quantity * ii.unit_price) FILTER (WHERE ii.has_igv) as gravada,
+            SUM(ii.quantity * ii.unit_price) FILTER (WHERE NOT ii.has_igv) as exonerada
+        FROM invoice_items ii
+        WHERE ii.invoice_id = i.id
+        HAVING COUNT(*) > 0
+    ) it ON TRUE
+"""
+
+
+def month_range(year: int, month: int = None) -> tuple:
+    """Primer y último día del mes (o del año si no se indica mes)"""
+    if month:
+        last_day = calendar.monthrange(year, month)[1]
+        return f"{year}-{month:02d}-01", f"{year}-{month:02d}-{last_day}"
+    return f"{year}-01-01", f"{year}-12-31"
+
+
+def ple_filename(ruc: str, year: int, month: int, has_data: bool = True) -> str:
+    """Nombre de archivo PLE: LE + RUC + AAAAMM00 + 140100 + 00 + oportunidad + indicador + moneda + 1"""
+    return f"LE{ruc}{year}{month:02d}00140100001{1 if has_data else 0}11.txt"
+
+
+class SalesRegisterExporter:
+    """
+    Exporta el registro de ventas directamente desde Postgres.
+
+    Las filas se formatean en el servidor y se copian con COPY ... TO STDOUT al
+    archivo destino (opcionalmente gzip), así que la memoria usada es constante
+    sin importar cuántos comprobantes tenga el periodo.
+    """
+
+    def __init__(self, db: Database = None):
+        self.db = db or Database()
+        if self.db.conn is None:
+            self.db.connect()
+
+    def _filters(self, sender_id: str, year: int, month: int = None,
+                 include_credit_notes: bool = True) -> tuple:
+        date_from, date_to = month_range(year, month)
+        query = " WHERE i.sender_id = %(sender_id)s AND i.date BETWEEN %(date_from)s AND %(date_to)s AND i.status IN %(statuses)s"
+        if not include_credit_notes:
+            query += " AND i.type <> 'NOTA_CREDITO'"
+        params = {
+            "sender_id": sender_id,
+            "date_from": date_from,
+            "date_to": date_to,
+            "statuses": REGISTER_STATUSES,
+            "period": f"{year}{(month or 12):02d}00",
+        }
+        return query, params
+
+    def build_query(self, sender_id: str, year: int, month: int = None, fmt: str = "csv",
+                    include_items: bool = False, include_credit_notes: bool = True) -> str:
+        """Arma la sentencia COPY con los parámetros ya enlazados"""
+        filters, params = self._filters(sender_id, year, month, include_credit_notes)
+        joins = " FROM invoices i LEFT JOIN invoices r ON r.id = i.referenced_invoice_id"
+
+        if fmt == "ple":
+            select = f"SELECT {PLE_LINE_SQL}{joins}{ITEMS_SPLIT_SQL}{filters} ORDER BY i.date, i.series, i.number"
+            copy_options = "(FORMAT text)"
+        elif fmt == "csv":
+            columns = CSV_COLUMNS
+            if include_items:
+                columns += CSV_ITEM_COLUMNS
+                joins += " LEFT JOIN invoice_items ii ON ii.invoice_id = i.id"
+            select = f"SELECT {columns}{joins}{filters} ORDER BY i.date, i.series, i.number"
+            copy_options = "(FORMAT csv, HEADER true)"
+        else:
+            raise ValueError(f"Formato no soportado: {fmt}")
+
+        with self.db.conn.cursor() as cur:
+            bound = cur.mogrify(select, params).decode()
+        return f"COPY ({bound}) TO STDOUT WITH {copy_options}"
+
+    def export(self, output, sender_id: str, year: int, month: int = None, fmt: str = "csv",
+               include_items: bool = False, include_credit_notes: bool = True,
+               compress: bool = False) -> Optional[str]:
+        """
+        Exporta el registro de ventas de un sender.
+
+        Args:
+            output: Ruta del archivo o file object binario
+            sender_id: Empresa emisora
+            year, month: Periodo (sin mes = año completo)
+            fmt: 'csv' o 'ple'
+            include_items: Una fila por item (solo CSV)
+            include_credit_notes: Incluir notas de crédito con su comprobante referenciado
+            compress: Escribir gzip (solo si output es una ruta)
+
+        Returns:
+            La ruta escrita (o None si output era un file object)
+        """
+        query = self.build_query(sender_id, year, month, fmt, include_items, include_credit_notes)
+        # Igual que InvoiceValidator: terminar la transacción de lectura (o la abortada
+        # por un COPY fallido) salvo que sea la del llamador
+        owns_transaction = not self.db.in_transaction
+        try:
+            if not isinstance(output, str):
+                with self.db.conn.cursor() as cur:
+                    cur.copy_expert(query, output, size=COPY_BUFFER_SIZE)
+                return None
+
+            path = output + ".gz" if compress and not output.endswith(".gz") else output
+            opener = gzip.open if compress else open
+            with opener(path, "wb") as f, self.db.conn.cursor() as cur:
+                cur.copy_expert(query, f, size=COPY_BUFFER_SIZE)
+            return path
+        finally:
+            if owns_transaction:
+                self.db.conn.rollback()
+
+    def export_ple(self, directory: str, sender_id: str, ruc: str, year: int, month: int,
+                   compress: bool = False) -> str:
+        """Exporta el PLE 14.1 de un mes con el nombre de archivo oficial"""
+        filters, params = self._filters(sender_id, year, month)
+        result = self.db.fetch_one(f"SELECT EXISTS (SELECT 1 FROM invoices i{filters}) as has_data", params, row_factory="dict")
+        filename = ple_filename(ruc, year, month, bool(result and result["has_data"]))
+        return self.export(f"{directory.rstrip('/')}/{filename}", sender_id, year, month,
+                           fmt="ple", compress=compress)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 4:
+        print("❌ Uso: python export.py <SENDER_ID> <AÑO> <MES|0> [csv|ple] [--items] [--gzip]")
+        sys.exit(1)
+
+    sender_id, year, month = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]) or None
+    fmt = sys.argv[4] if len(sys.argv) > 4 and not sys.argv[4].startswith("--") else "csv"
+    exporter = SalesRegisterExporter()
+    path = exporter.export(
+        f"registro_ventas_{sender_id}_{year}{(month or 0):02d}.{'txt' if fmt == 'ple' else 'csv'}",
+        sender_id, year, month, fmt=fmt,
+        include_items="--items" in sys.argv, compress="--gzip" in sys.argv,
+    )
+    print(f"✅ Registro exportado: {path}")
+    exporter.db.close()
@@ -0,0 +1,203 @@
+# migrate_credentials.py - Re-encriptación masiva de credenciales SUNAT (rotación de clave / unificación de formato)
+#
+# Formatos existentes:
+#   fernet → crypto.py          (salt factumovil_salt_v1)
+#   aesgcm → frontend y crypto_decrypt.py (salt factumovil-salt-v1, IV 12 bytes + datos, Base64)
+#
+# crypto.decrypt lee ambos formatos con FACTUMOVIL_ENCRYPTION_KEY o FACTUMOVIL_NEW_ENCRYPTION_KEY:
+# desplegar el backend con la clave nueva configurada ANTES de migrar, y correr la migración
+# una segunda vez antes de retirar la clave vieja (ver crypto.py)
+import base64
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Tuple
+
+from psycopg2.extras import execute_values
+
+from connection import Database
+
+FORMATS = ("fernet", "aesgcm")
+CHECKPOINT_FILE = ".migrate_credentials.json"
+
+UPDATE_SQL = """
+    UPDATE senders s
+    SET sunat_user_encrypted = v.new_user, sunat_pass_encrypted = v.new_pass
+    FROM (VALUES %s) AS v(id, old_user, old_pass, new_user, new_pass)
+    WHERE s.id = v.id
+      AND s.sunat_user_encrypted IS NOT DISTINCT FROM v.old_user
+      AND s.sunat_pass_encrypted IS NOT DISTINCT FROM v.old_pass
+"""
+
+# Estado por proceso: las claves se derivan una sola vez en el initializer
+_worker = {}
+
+
+def _init_worker(source_keys: dict, target_format: str, target_key: str):
+    """Deriva (PBKDF2 100k) todas las claves necesarias una vez por proceso"""
+    from crypto import _derive_fernet
+    from crypto_decrypt import _derive_key
+
+    _worker["sources"] = []
+    for fmt, key in source_keys.items():
+        if key:
+            _worker["sources"].append((fmt, _derive_fernet(key) if fmt == "fernet" else _derive_key(key)))
+    _worker["target_format"] = target_format
+    _worker["target"] = _derive_fernet(target_key) if target_format == "fernet" else _derive_key(target_key)
+
+
+def _decrypt_with(fmt: str, key, value: str) -> str:
+    if fmt == "fernet":
+        return key.decrypt(value.encode()).decode()
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    combined = base64.b64decode(value)
+    return AESGCM(key).decrypt(combined[:12], combined[12:], None).decode("utf-8")
+
+
+def _encrypt_with(fmt: str, key, plain_text: str) -> str:
+    if fmt == "fernet":
+        return key.encrypt(plain_text.encode()).decode()
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    iv = os.urandom(12)
+    return base64.b64encode(iv + AESGCM(key).encrypt(iv, plain_text.encode("utf-8"), None)).decode()
+
+
+def _convert(value: Optional[str]) -> Tuple[str, Optional[str]]:
+    """Retorna (estado, nuevo_valor): 'empty', 'current', 'migrated' o 'error'"""
+    if not value:
+        return "empty", value
+    target_format, target = _worker["target_format"], _worker["target"]
+    try:
+        _decrypt_with(target_format, target, value)
+        return "current", value
+    except Exception:
+        pass
+    for fmt, key in _worker["sources"]:
+        try:
+            plain = _decrypt_with(fmt, key, value)
+        except Exception:
+            continue
+        new_value = _encrypt_with(target_format, target, plain)
+        if _decrypt_with(target_format, target, new_value) != plain:
+            return "error", None
+        return "migrated", new_value
+    return "error", None
+
+
+def reencrypt_rows(rows: List[tuple]) -> List[tuple]:
+    """Trabajo de un proceso: (id, user, pass) → (id, old_user, old_pass, new_user, new_pass, estados)"""
+    results = []
+    for sender_id, user_enc, pass_enc in rows:
+        user_status, new_user = _convert(user_enc)
+        pass_status, new_pass = _convert(pass_enc)
+        results.append((sender_id, user_enc, pass_enc, new_user, new_pass, (user_status, pass_status)))
+    return results
+
+
+def _load_checkpoint(path: str) -> int:
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f).get("last_id", 0)
+    return 0
+
+
+def _save_checkpoint(path: str, last_id: int):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"last_id": last_id}, f)
+    os.replace(tmp, path)
+
+
+def migrate(target_format: str = "aesgcm", target_key: str = None, fernet_key: str = None,
+            aesgcm_key: str = None, batch_size: int = 1000, workers: int = None,
+            dry_run: bool = False, resume: bool = True, checkpoint: str = CHECKPOINT_FILE) -> dict:
+    """
+    Re-encripta sunat_user_encrypted / sunat_pass_encrypted de todos los senders.
+
+    Es idempotente (los valores que ya están en el formato y clave destino se
+    saltan) y reanudable (se guarda el último id procesado en `checkpoint`).
+    En dry_run solo verifica que cada valor se pueda convertir, sin escribir.
+    """
+    if target_format not in FORMATS:
+        raise ValueError(f"Formato destino no soportado: {target_format}")
+    if not target_key:
+        raise ValueError("Se requiere la clave destino")
+
+    reader, writer = Database(), Database()
+    if not reader.connect() or not writer.connect():
+        return {}
+
+    last_id = _load_checkpoint(checkpoint) if resume and not dry_run else 0
+    stats = {"senders": 0, "migrated": 0, "current": 0, "empty": 0, "error": 0, "updated": 0}
+    chunk = max(1, batch_size // (workers or os.cpu_count() or 1))
+
+    cur = reader.conn.cursor(name="migrate_credentials")
+    cur.itersize = batch_size
+    cur.execute(
+        "SELECT id, sunat_user_encrypted, sunat_pass_encrypted FROM senders WHERE id > %s ORDER BY id",
+        (last_id,)
+    )
+    source_keys = {"fernet": fernet_key, "aesgcm": aesgcm_key}
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(source_keys, target_format, target_key)) as pool:
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            parts = [rows[i:i + chunk] for i in range(0, len(rows), chunk)]
+            results = [r for part in pool.map(reencrypt_rows, parts) for r in part]
+
+            updates = []
+            for sender_id, old_user, old_pass, new_user, new_pass, statuses in results:
+                stats["senders"] += 1
+                for status in statuses:
+                    stats[status] += 1
+                if "error" in statuses:
+                    print(f"   ✗ Sender {sender_id}: no se pudo desencriptar con ninguna clave")
+                elif "migrated" in statuses:
+                    updates.append((sender_id, old_user, old_pass, new_user, new_pass))
+
+            if updates and not dry_run:
+                with writer.transaction():
+                    execute_values(writer.cursor, UPDATE_SQL, updates, page_size=len(updates))
+                    stats["updated"] += writer.cursor.rowcount
+            if not dry_run:
+                _save_checkpoint(checkpoint, rows[-1][0])
+            print(f"   ✓ Hasta sender {rows[-1][0]}: {stats['senders']} procesados")
+
+    cur.close()
+    reader.close()
+    writer.close()
+    if not dry_run and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Re-encripta las credenciales SUNAT de los senders")
+    parser.add_argument("--to-format", choices=FORMATS,
+                        default=os.environ.get("FACTUMOVIL_NEW_ENCRYPTION_FORMAT", "aesgcm"))
+    parser.add_argument("--to-key", default=os.environ.get("FACTUMOVIL_NEW_ENCRYPTION_KEY"))
+    # Mismos defaults que crypto.py / crypto_decrypt.py (incluida su clave por defecto)
+    from crypto import ENCRYPTION_KEY as FERNET_KEY
+    from crypto_decrypt import ENCRYPTION_KEY as AESGCM_KEY
+    parser.add_argument("--fernet-key", default=FERNET_KEY, help="Clave maestra actual de crypto.py")
+    parser.add_argument("--aesgcm-key", default=AESGCM_KEY,
+                        help="Clave maestra actual del frontend / crypto_decrypt.py")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--dry-run", action="store_true", help="Solo verificar, sin escribir")
+    parser.add_argument("--restart", action="store_true", help="Ignorar el checkpoint y empezar desde el inicio")
+    args = parser.parse_args()
+
+    print(f"\n🔐 Migrando credenciales → {args.to_format}{' (dry-run)' if args.dry_run else ''}")
+    print("=" * 50)
+    result = migrate(args.to_format, args.to_key, args.fernet_key, args.aesgcm_key,
+                     args.batch_size, args.workers, args.dry_run, not args.restart)
+    print("=" * 50)
+    for name, value in result.items():
+        print(f"   • {name}: {value}")
+    if result.get("error"):
+        raise SystemExit(1)
@@ -0,0 +1,195 @@
+# product_matcher.py - Resuelve los productos extraídos por la IA (IAExtractionResult) al catálogo del sender
+import math
+import unicodedata
+from collections import defaultdict
+from typing import List, Dict
+
+from repository import Repository
+
+NGRAM_SIZE = 3
+IGV_RATE = 1.18
+
+# Pesos del score combinado
+WEIGHT_DESCRIPTION = 0.75
+WEIGHT_UNIT = 0.10
+WEIGHT_PRICE = 0.15
+
+# Sinónimos frecuentes de unidad que devuelve Gemini
+UNIT_ALIASES = {
+    "KG": "KILOGRAMO", "KGS": "KILOGRAMO", "KILO": "KILOGRAMO", "KILOS": "KILOGRAMO",
+    "UND": "UNIDAD", "UNID": "UNIDAD", "UN": "UNIDAD", "NIU": "UNIDAD", "UNIDADES": "UNIDAD",
+    "CJ": "CAJA", "CAJAS": "CAJA",
+    "BOLSAS": "BOLSA", "BL": "BOLSA",
+    "SACOS": "SACO",
+}
+
+
+def normalize_text(text: str) -> str:
+    """Mayúsculas, sin tildes y con espacios simples"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text.upper())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join("".join(c if c.isalnum() else " " for c in text).split())
+
+
+def normalize_unit(unit: str) -> str:
+    unit = normalize_text(unit)
+    return UNIT_ALIASES.get(unit, unit)
+
+
+def ngrams(text: str, n: int = NGRAM_SIZE) -> set:
+    """N-gramas de caracteres con padding para que las palabras cortas también cuenten"""
+    text = f" {normalize_text(text)} "
+    if len(text) <= n:
+        return {text} if text.strip() else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def price_proximity(extracted: float, base_price: float) -> float:
+    """1.0 si coincide el precio (con o sin IGV), decrece linealmente con la diferencia relativa"""
+    if not extracted or not base_price:
+        return 0.0
+    best = 0.0
+    for reference in (base_price, base_price * IGV_RATE):
+        diff = abs(extracted - reference) / max(extracted, reference)
+        best = max(best, 1.0 - diff)
+    return max(best, 0.0)
+
+
+class CatalogIndex:
+    """Índice invertido de n-gramas (ponderados por IDF) del catálogo de un sender"""
+
+    def __init__(self, products: List[Dict]):
+        self.product_ids = [p["id"] for p in products]
+        self.descriptions = [p["description"] for p in products]
+        self.units = [normalize_unit(p.get("unit") or "") for p in products]
+        self.prices = [float(p.get("base_price") or 0) for p in products]
+
+        grams_per_product = [ngrams(d) for d in self.descriptions]
+        document_freq = defaultdict(int)
+        for grams in grams_per_product:
+            for g in grams:
+                document_freq[g] += 1
+
+        total = len(products)
+        self.idf = {g: math.log(1 + total / df) for g, df in document_freq.items()}
+        self.postings = defaultdict(list)
+        self.norms = [0.0] * total
+        for idx, grams in enumerate(grams_per_product):
+            for g in grams:
+                self.postings[g].append(idx)
+                self.norms[idx] += self.idf[g]
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def description_scores(self, text: str) -> Dict[int, float]:
+        """Dice ponderado entre la descripción y cada producto que comparte algún n-grama"""
+        grams = ngrams(text)
+        # Los n-gramas que no están en el catálogo igual cuentan en la norma de la consulta
+        query_norm = sum(self.idf.get(g, math.log(1 + max(len(self), 1))) for g in grams)
+        if not query_norm:
+            return {}
+        shared = defaultdict(float)
+        for g in grams:
+            weight = self.idf.get(g)
+            if weight is None:
+                continue
+            for idx in self.postings[g]:
+                shared[idx] += weight
+        return {idx: 2 * w / (query_norm + self.norms[idx]) for idx, w in shared.items()}
+
+
+class ProductMatcher:
+    """
+    Resuelve en bloque las líneas de un IAExtractionResult a products.id.
+
+    Mantiene un índice por sender en memoria; se reconstruye solo cuando cambia
+    la versión del catálogo (COUNT + MAX(updated_at)), así que resolver una boleta
+    completa cuesta una sola query liviana.
+    """
+
+    def __init__(self, repo: Repository = None):
+        self.repo = repo or Repository()
+        self._indexes: Dict[str, tuple] = {}
+
+    def invalidate(self, sender_id: str = None):
+        """Descarta el índice de un sender (o de todos)"""
+        if sender_id is None:
+            self._indexes.clear()
+        else:
+            self._indexes.pop(str(sender_id), None)
+
+    def get_index(self, sender_id: str) -> CatalogIndex:
+        key = str(sender_id)
+        version = self.repo.get_catalog_version(sender_id)
+        cached = self._indexes.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+        index = CatalogIndex(self.repo.get_products(sender_id, row_factory="dict"))
+        self._indexes[key] = (version, index)
+        return index
+
+    def match(self, sender_id: str, productos: List[Dict], top_k: int = 3,
+              min_score: float = 0.3) -> List[Dict]:
+        """
+        Puntúa todas las líneas extraídas contra el catálogo en una sola pasada.
+
+        Args:
+            sender_id: Empresa emisora
+            productos: Lista `productos` del IAExtractionResult
+            top_k: Candidatos a devolver por línea
+            min_score: Score mínimo para asignar product_id
+
+        Returns:
+            Una entrada por línea con product_id (o None), confidence y candidates
+        """
+        index = self.get_index(sender_id)
+        results = []
+        for line in productos:
+            unit = normalize_unit(line.get("unidad_medida") or "")
+            price = float(line.get("precio_base") or 0)
+            candidates = []
+            for idx, desc_score in index.description_scores(line.get("descripcion") or "").items():
+                unit_score = 1.0 if unit and unit == index.units[idx] else 0.0
+                score = (WEIGHT_DESCRIPTION * desc_score
+                         + WEIGHT_UNIT * unit_score
+                         + WEIGHT_PRICE * price_proximity(price, index.prices[idx]))
+                candidates.append((score, idx))
+            candidates.sort(reverse=True)
+            top = [{
+                "product_id": index.product_ids[idx],
+                "description": index.descriptions[idx],
+                "score": round(score, 4),
+            } for score, idx in candidates[:top_k]]
+
+            best = top[0] if top and top[0]["score"] >= min_score else None
+            results.append({
+                "descripcion": line.get("descripcion"),
+                "product_id": best["product_id"] if best else None,
+                "confidence": best["score"] if best else 0.0,
+                "candidates": top,
+            })
+        return results
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print("❌ Uso: python product_matcher.py <SENDER_ID> <DESCRIPCION> [UNIDAD] [PRECIO]")
+        sys.exit(1)
+
+    line = {"descripcion": sys.argv[2]}
+    if len(sys.argv) > 3:
+        line["unidad_medida"] = sys.argv[3]
+    if len(sys.argv) > 4:
+        line["precio_base"] = float(sys.argv[4])
+
+    matcher = ProductMatcher()
+    for r in matcher.match(sys.argv[1], [line]):
+        print(f"🔎 {r['descripcion']} → {r['product_id']} ({r['confidence']:.2f})")
+        for c in r["candidates"]:
+            print(f"   • {c['product_id']}: {c['description']} ({c['score']:.2f})")
+    matcher.repo.close()
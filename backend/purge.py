@@ -0,0 +1,136 @@
+# purge.py - Borrado por lotes en segundo plano (delete_sender / delete_invoice sin un DELETE CASCADE gigante)
+import threading
+import time
+from typing import Callable, Optional
+
+from connection import Database
+
+# Pasos del borrado de un sender, de hoja a raíz. Cada DELETE borra a lo sumo %(batch)s filas.
+SENDER_STEPS = [
+    ("invoice_items", """
+        DELETE FROM invoice_items WHERE id IN (
+            SELECT ii.id FROM invoice_items ii JOIN invoices i ON i.id = ii.invoice_id
+            WHERE i.sender_id = %(id)s LIMIT %(batch)s
+        )
+    """, "SELECT COUNT(*) as count FROM invoice_items ii JOIN invoices i ON i.id = ii.invoice_id WHERE i.sender_id = %(id)s"),
+    # Primero las notas de crédito: referenced_invoice_id no tiene ON DELETE CASCADE
+    ("credit_notes", """
+        DELETE FROM invoices WHERE id IN (
+            SELECT id FROM invoices WHERE sender_id = %(id)s AND referenced_invoice_id IS NOT NULL LIMIT %(batch)s
+        )
+    """, "SELECT COUNT(*) as count FROM invoices WHERE sender_id = %(id)s AND referenced_invoice_id IS NOT NULL"),
+    ("invoices", """
+        DELETE FROM invoices WHERE id IN (
+            SELECT id FROM invoices WHERE sender_id = %(id)s LIMIT %(batch)s
+        )
+    """, "SELECT COUNT(*) as count FROM invoices WHERE sender_id = %(id)s AND referenced_invoice_id IS NULL"),
+    ("clients", """
+        DELETE FROM clients WHERE id IN (SELECT id FROM clients WHERE sender_id = %(id)s LIMIT %(batch)s)
+    """, "SELECT COUNT(*) as count FROM clients WHERE sender_id = %(id)s"),
+    ("products", """
+        DELETE FROM products WHERE id IN (SELECT id FROM products WHERE sender_id = %(id)s LIMIT %(batch)s)
+    """, "SELECT COUNT(*) as count FROM products WHERE sender_id = %(id)s"),
+    ("senders", "DELETE FROM senders WHERE id = %(id)s", None),
+]
+
+INVOICE_STEPS = [
+    ("invoice_items", """
+        DELETE FROM invoice_items WHERE id IN (
+            SELECT id FROM invoice_items WHERE invoice_id = %(id)s LIMIT %(batch)s
+        )
+    """, "SELECT COUNT(*) as count FROM invoice_items WHERE invoice_id = %(id)s"),
+    ("invoices", "DELETE FROM invoices WHERE id = %(id)s", None),
+]
+
+# referenced_invoice_id no tiene ON DELETE: con notas de crédito apuntando al comprobante el
+# DELETE final fallaría después de haber borrado (y confirmado) todos sus items
+INVOICE_REFERENCES_SQL = "SELECT COUNT(*) as count FROM invoices WHERE referenced_invoice_id = %(id)s"
+
+MARK_SENDER_SQL = "UPDATE senders SET deleting_at = COALESCE(deleting_at, NOW()) WHERE id = %(id)s"
+
+
+class PurgeJob(threading.Thread):
+    """
+    Borra un sender (o un comprobante) y sus hijos en lotes acotados.
+
+    Cada lote es su propia transacción corta sobre una conexión dedicada, con
+    una pausa entre lotes para no acaparar locks ni WAL. Repository.purge_sender
+    marca el sender con `deleting_at` antes de lanzar el job (y el job lo vuelve a
+    marcar si se lanza suelto), así desaparece de las lecturas aunque el borrado
+    tarde. Un comprobante no se marca: sus items van desapareciendo por lotes.
+    Si el job se interrumpe basta con volver a lanzarlo.
+    """
+
+    def __init__(self, kind: str, target_id, dsn: str = None, batch_size: int = 1000,
+                 pause: float = 0.1, on_progress: Callable[[str, int, int], None] = None):
+        super().__init__(name=f"purge-{kind}-{target_id}", daemon=True)
+        if kind not in ("sender", "invoice"):
+            raise ValueError(f"Tipo de purga no soportado: {kind}")
+        self.kind = kind
+        self.target_id = target_id
+        self.dsn = dsn
+        self.batch_size = batch_size
+        self.pause = pause
+        self.on_progress = on_progress or self._print_progress
+        self.deleted = {}
+        self.done = False
+        self.error: Optional[Exception] = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Detiene el job después del lote en curso (se puede reanudar luego)"""
+        self._cancelled.set()
+
+    def _print_progress(self, step: str, deleted: int, total: int):
+        print(f"   🗑️  {self.kind} {self.target_id} · {step}: {deleted}/{total}")
+
+    def run(self):
+        db = Database(dsn=self.dsn)
+        params = {"id": self.target_id, "batch": self.batch_size}
+        try:
+            if self.kind == "sender":
+                if not db.execute(MARK_SENDER_SQL, params):
+                    raise db.last_error
+            else:
+                references = db.fetch_one(INVOICE_REFERENCES_SQL, params)
+                if references is None:
+                    raise db.last_error
+                if references["count"]:
+                    raise ValueError(f"El comprobante tiene {references['count']} notas de crédito que lo referencian")
+            for step, delete_sql, count_sql in (SENDER_STEPS if self.kind == "sender" else INVOICE_STEPS):
+                total = db.fetch_one(count_sql, params)["count"] if count_sql else 1
+                self.deleted[step] = 0
+                while not self._cancelled.is_set():
+                    if not db.execute(delete_sql, params):
+                        raise db.last_error
+                    removed = db.cursor.rowcount
+                    self.deleted[step] += removed
+                    self.on_progress(step, self.deleted[step], total)
+                    if removed < self.batch_size or not count_sql:
+                        break
+                    time.sleep(self.pause)
+                if self._cancelled.is_set():
+                    print(f"⏸️  Purga de {self.kind} {self.target_id} cancelada")
+                    return
+            self.done = True
+            print(f"✅ Purga de {self.kind} {self.target_id} completada")
+        except Exception as e:
+            self.error = e
+            print(f"❌ Purga de {self.kind} {self.target_id} falló: {e}")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ("sender", "invoice"):
+        print("❌ Uso: python purge.py <sender|invoice> <ID> [BATCH_SIZE] [PAUSA_SEG]")
+        sys.exit(1)
+
+    job = PurgeJob(sys.argv[1], sys.argv[2],
+                   batch_size=int(sys.argv[3]) if len(sys.argv) > 3 else 1000,
+                   pause=float(sys.argv[4]) if len(sys.argv) > 4 else 0.1)
+    job.start()
+    job.join()
+    sys.exit(0 if job.done else 1)
@@ -1,74 +1,167 @@
 # repository.py - CRUD operations para FactuMovil AI (con Supabase Auth)
+from contextlib import contextmanager
+
 from connection import Database
-from crypto import encrypt, decrypt
-from typing import Optional, List, Dict
-import uuid
+from validator import check_invoice
+from sender_cache import SenderCache
+from purge import PurgeJob, MARK_SENDER_SQL, INVOICE_REFERENCES_SQL
+from typing import Optional, List, Dict, Iterable, Tuple
+
+
+def encrypt(plain_text: str) -> Optional[str]:
+    # Import diferido: cryptography + derivación de clave solo si se tocan credenciales
+    if not plain_text:
+        return None
+    from crypto import encrypt as _encrypt
+    return _encrypt(plain_text)
+
+
+def decrypt(encrypted_text: str) -> Optional[str]:
+    if not encrypted_text:
+        return None
+    from crypto import decrypt as _decrypt
+    return _decrypt(encrypted_text)
+
+
+INSERT_INVOICE_ITEM = """
+    INSERT INTO invoice_items (invoice_id, product_id, description, quantity, unit, unit_price, has_igv, total)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# Notas de crédito que no descuentan saldo
+VOID_STATUSES = "('RECHAZADO', 'ANULADO', 'FALLO')"
 
 
 class Repository:
-    def __init__(self):
-        self.db = Database()
-        self.db.connect()
+    def __init__(self, row_factory="dict", dsn: str = None, sender_cache: SenderCache = None,
+                 lazy: bool = True, replica_dsn: str = None, max_replica_lag: float = 5.0):
+        """
+        Args:
+            row_factory: Formato de fila de los listados (ver connection.Database)
+            dsn: Connection string alternativa; por defecto Supabase (config.py)
+            sender_cache: Cache de senders a usar (compartible entre repositorios)
+            lazy: Conectar recién en la primera query (False = conectar ya)
+            replica_dsn: Réplica de lectura para listados y reportes (ver connection.Database)
+            max_replica_lag: Segundos de lag tolerados en la réplica
+        """
+        self.db = Database(row_factory, dsn, replica_dsn, max_replica_lag)
+        if not lazy:
+            self.db.connect()
+        self.sender_cache = sender_cache if sender_cache is not None else SenderCache()
+        # Senders escritos en la transacción en curso: se vuelven a invalidar al terminarla
+        self._dirty_senders = set()
 
     def close(self):
         self.db.close()
 
+    @contextmanager
+    def transaction(self):
+        """Unit of work: `with repo.transaction(): ...` hace un solo commit al final"""
+        outermost = not self.db.in_transaction
+        try:
+            with self.db.transaction() as db:
+                yield db
+        finally:
+            if outermost:
+                # Otro lector pudo cachear la fila vieja entre el UPDATE y el commit
+                for sender_id in self._dirty_senders:
+                    self.sender_cache.invalidate(sender_id)
+                self._dirty_senders.clear()
+
+    def _invalidate_sender(self, sender_id: str):
+        self.sender_cache.invalidate(sender_id)
+        if self.db.in_transaction:
+            self._dirty_senders.add(sender_id)
+
     # ==================== SENDERS ====================
     def get_senders(self, user_id: str = None) -> List[Dict]:
         if user_id:
-            return self.db.fetch_all("SELECT * FROM senders WHERE user_id = %s ORDER BY name", (user_id,))
-        return self.db.fetch_all("SELECT * FROM senders ORDER BY name")
-
-    def get_sender_by_id(self, sender_id: str) -> Optional[Dict]:
-        sender = self.db.fetch_one("SELECT * FROM senders WHERE id = %s", (sender_id,))
+            senders = self.db.fetch_all("SELECT * FROM senders WHERE user_id = %s AND deleting_at IS NULL ORDER BY name", (user_id,), row_factory="dict")
+        else:
+            senders = self.db.fetch_all("SELECT * FROM senders WHERE deleting_at IS NULL ORDER BY name", row_factory="dict")
+        for sender in senders:
+            self.sender_cache.observe(sender)
+        return senders
+
+    def _load_sender(self, sender: Optional[Dict]) -> Optional[Dict]:
         if sender:
             # Desencriptar credenciales SUNAT
             sender['sunat_user'] = decrypt(sender.get('sunat_user_encrypted'))
             sender['sunat_pass'] = decrypt(sender.get('sunat_pass_encrypted'))
+            # Dentro de una transacción la fila puede no confirmarse nunca: no se cachea
+            if not self.db.in_transaction:
+                self.sender_cache.put(sender)
         return sender
 
+    def get_sender_by_id(self, sender_id: str) -> Optional[Dict]:
+        cached = self.sender_cache.get(sender_id=sender_id, decrypt=decrypt)
+        if cached:
+            return cached
+        return self._load_sender(
+            self.db.fetch_one("SELECT * FROM senders WHERE id = %s AND deleting_at IS NULL", (sender_id,), row_factory="dict"))
+
     def get_sender_by_ruc(self, ruc: str) -> Optional[Dict]:
-        sender = self.db.fetch_one("SELECT * FROM senders WHERE ruc = %s", (ruc,))
-        if sender:
-            sender['sunat_user'] = decrypt(sender.get('sunat_user_encrypted'))
-            sender['sunat_pass'] = decrypt(sender.get('sunat_pass_encrypted'))
-        return sender
+        cached = self.sender_cache.get(ruc=ruc, decrypt=decrypt)
+        if cached:
+            return cached
+        return self._load_sender(
+            self.db.fetch_one("SELECT * FROM senders WHERE ruc = %s AND deleting_at IS NULL", (ruc,), row_factory="dict"))
 
     def create_sender(self, user_id: str, name: str, ruc: str, sunat_user: str = None, sunat_pass: str = None) -> Optional[str]:
-        sender_id = str(uuid.uuid4())
         # Encriptar credenciales SUNAT antes de guardar
         sunat_user_enc = encrypt(sunat_user) if sunat_user else None
         sunat_pass_enc = encrypt(sunat_pass) if sunat_pass else None
-        success = self.db.execute(
-            "INSERT INTO senders (id, user_id, name, ruc, sunat_user_encrypted, sunat_pass_encrypted) VALUES (%s, %s, %s, %s, %s, %s)",
-            (sender_id, user_id, name, ruc, sunat_user_enc, sunat_pass_enc)
+        row = self.db.execute_returning(
+            "INSERT INTO senders (user_id, name, ruc, sunat_user_encrypted, sunat_pass_encrypted) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+            (user_id, name, ruc, sunat_user_enc, sunat_pass_enc)
         )
-        return sender_id if success else None
+        return row['id'] if row else None
 
     def update_sender(self, sender_id: str, **kwargs) -> bool:
         fields = ", ".join([f"{k} = %s" for k in kwargs.keys()])
         values = list(kwargs.values()) + [sender_id]
-        return self.db.execute(f"UPDATE senders SET {fields} WHERE id = %s", values)
+        updated = self.db.execute(f"UPDATE senders SET {fields} WHERE id = %s", values)
+        if updated:
+            self._invalidate_sender(sender_id)
+        return updated
 
     def delete_sender(self, sender_id: str) -> bool:
-        return self.db.execute("DELETE FROM senders WHERE id = %s", (sender_id,))
+        deleted = self.db.execute("DELETE FROM senders WHERE id = %s", (sender_id,))
+        if deleted:
+            self._invalidate_sender(sender_id)
+        return deleted
+
+    def purge_sender(self, sender_id: str, batch_size: int = 1000, pause: float = 0.1,
+                     on_progress=None) -> PurgeJob:
+        """Borrado por lotes en segundo plano; el sender deja de verse de inmediato"""
+        # Marcar antes de lanzar el job: al retornar ya no aparece en las lecturas
+        if not self.db.execute(MARK_SENDER_SQL, {"id": sender_id}):
+            raise self.db.last_error
+        self._invalidate_sender(sender_id)
+        job = PurgeJob("sender", sender_id, self.db.dsn, batch_size, pause, on_progress)
+        job.start()
+        return job
 
     # ==================== CLIENTS ====================
-    def get_clients(self, sender_id: str = None) -> List[Dict]:
+    def get_clients(self, sender_id: str = None, updated_since: str = None, row_factory=None,
+                    primary: bool = None) -> List[Dict]:
+        if sender_id and updated_since:
+            return self.db.fetch_all("SELECT * FROM clients WHERE sender_id = %s AND updated_at > %s ORDER BY name",
+                                     (sender_id, updated_since), row_factory=row_factory, primary=primary)
         if sender_id:
-            return self.db.fetch_all("SELECT * FROM clients WHERE sender_id = %s ORDER BY name", (sender_id,))
-        return self.db.fetch_all("SELECT * FROM clients ORDER BY name")
+            return self.db.fetch_all("SELECT * FROM clients WHERE sender_id = %s ORDER BY name", (sender_id,),
+                                     row_factory=row_factory, primary=primary)
+        return self.db.fetch_all("SELECT * FROM clients ORDER BY name", row_factory=row_factory, primary=primary)
 
     def get_client_by_id(self, client_id: str) -> Optional[Dict]:
         return self.db.fetch_one("SELECT * FROM clients WHERE id = %s", (client_id,))
 
     def create_client(self, sender_id: str, name: str, dni: str = None, ruc: str = None, phone: str = None) -> Optional[str]:
-        client_id = str(uuid.uuid4())
-        success = self.db.execute(
-            "INSERT INTO clients (id, sender_id, name, dni, ruc, phone) VALUES (%s, %s, %s, %s, %s, %s)",
-            (client_id, sender_id, name, dni, ruc, phone)
+        row = self.db.execute_returning(
+            "INSERT INTO clients (sender_id, name, dni, ruc, phone) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+            (sender_id, name, dni, ruc, phone)
         )
-        return client_id if success else None
+        return row['id'] if row else None
 
     def update_client(self, client_id: str, **kwargs) -> bool:
         fields = ", ".join([f"{k} = %s" for k in kwargs.keys()])
@@ -79,22 +172,63 @@ class Repository:
         return self.db.execute("DELETE FROM clients WHERE id = %s", (client_id,))
 
     # ==================== PRODUCTS ====================
-    def get_products(self, sender_id: str = None) -> List[Dict]:
+    def get_products(self, sender_id: str = None, updated_since: str = None, row_factory=None,
+                     primary: bool = None) -> List[Dict]:
+        if sender_id and updated_since:
+            return self.db.fetch_all("SELECT * FROM products WHERE sender_id = %s AND updated_at > %s ORDER BY description",
+                                     (sender_id, updated_since), row_factory=row_factory, primary=primary)
         if sender_id:
-            return self.db.fetch_all("SELECT * FROM products WHERE sender_id = %s ORDER BY description", (sender_id,))
-        return self.db.fetch_all("SELECT * FROM products ORDER BY description")
+            return self.db.fetch_all("SELECT * FROM products WHERE sender_id = %s ORDER BY description", (sender_id,),
+                                     row_factory=row_factory, primary=primary)
+        return self.db.fetch_all("SELECT * FROM products ORDER BY description", row_factory=row_factory, primary=primary)
+
+    def get_catalog_version(self, sender_id: str) -> tuple:
+        """Versión barata del catálogo (cantidad + último updated_at) para invalidar caches"""
+        result = self.db.fetch_one(
+            "SELECT COUNT(*) as count, MAX(updated_at) as last_update FROM products WHERE sender_id = %s",
+            (sender_id,), row_factory="dict"
+        )
+        return (result['count'], result['last_update']) if result else (0, None)
+
+    def get_catalog_state(self, sender_id: str) -> Optional[Dict]:
+        """
+        Conteos y últimos cambios de productos, clientes y borrados (un round trip).
+
+        Siempre del primario: en la réplica NOW() puede ir hasta max_replica_lag
+        por delante de las filas ya reproducidas y el watermark saltaría cambios.
+        """
+        return self.db.fetch_one("""
+            SELECT
+                (SELECT COUNT(*) FROM products WHERE sender_id = %(id)s) as products_count,
+                (SELECT MAX(updated_at) FROM products WHERE sender_id = %(id)s) as products_last,
+                (SELECT COUNT(*) FROM clients WHERE sender_id = %(id)s) as clients_count,
+                (SELECT MAX(updated_at) FROM clients WHERE sender_id = %(id)s) as clients_last,
+                (SELECT MAX(deleted_at) FROM catalog_tombstones WHERE sender_id = %(id)s) as tombstones_last,
+                NOW() as server_time
+        """, {"id": sender_id}, row_factory="dict", primary=True)
+
+    def get_tombstones(self, sender_id: str, since: str, primary: bool = None) -> List[Dict]:
+        """Productos/clientes borrados después de `since`"""
+        return self.db.fetch_all(
+            "SELECT table_name, row_id, deleted_at FROM catalog_tombstones WHERE sender_id = %s AND deleted_at > %s ORDER BY deleted_at",
+            (sender_id, since), row_factory="dict", primary=primary
+        )
+
+    def purge_tombstones(self, older_than_days: int = 30) -> bool:
+        return self.db.execute(
+            "DELETE FROM catalog_tombstones WHERE deleted_at < NOW() - make_interval(days => %s)", (older_than_days,)
+        )
 
     def get_product_by_id(self, product_id: str) -> Optional[Dict]:
         return self.db.fetch_one("SELECT * FROM products WHERE id = %s", (product_id,))
 
     def create_product(self, sender_id: str, description: str, unit: str = "UNIDAD",
                        base_price: float = 0, has_igv: bool = True, stock: int = 0) -> Optional[str]:
-        product_id = str(uuid.uuid4())
-        success = self.db.execute(
-            "INSERT INTO products (id, sender_id, description, unit, base_price, has_igv, stock) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-            (product_id, sender_id, description, unit, base_price, has_igv, stock)
+        row = self.db.execute_returning(
+            "INSERT INTO products (sender_id, description, unit, base_price, has_igv, stock) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id",
+            (sender_id, description, unit, base_price, has_igv, stock)
         )
-        return product_id if success else None
+        return row['id'] if row else None
 
     def update_product(self, product_id: str, **kwargs) -> bool:
         fields = ", ".join([f"{k} = %s" for k in kwargs.keys()])
@@ -112,7 +246,7 @@ class Repository:
         return self.db.execute("DELETE FROM products WHERE id = %s", (product_id,))
 
     # ==================== INVOICES ====================
-    def get_invoices(self, sender_id: str = None, status: str = None) -> List[Dict]:
+    def get_invoices(self, sender_id: str = None, status: str = None, primary: bool = None) -> List[Dict]:
         query = "SELECT * FROM invoices WHERE 1=1"
         params = []
         if sender_id:
@@ -122,10 +256,10 @@ class Repository:
             query += " AND status = %s"
             params.append(status)
         query += " ORDER BY date DESC, created_at DESC"
-        return self.db.fetch_all(query, params if params else None)
+        return self.db.fetch_all(query, params if params else None, primary=primary)
 
     def get_invoice_by_id(self, invoice_id: str) -> Optional[Dict]:
-        invoice = self.db.fetch_one("SELECT * FROM invoices WHERE id = %s", (invoice_id,))
+        invoice = self.db.fetch_one("SELECT * FROM invoices WHERE id = %s", (invoice_id,), row_factory="dict")
         if invoice:
             invoice['items'] = self.get_invoice_items(invoice_id)
         return invoice
@@ -134,7 +268,7 @@ class Repository:
         """Obtiene el siguiente número correlativo para una serie"""
         result = self.db.fetch_one(
             "SELECT COALESCE(MAX(CAST(number AS INTEGER)), 0) + 1 as next_num FROM invoices WHERE sender_id = %s AND series = %s",
-            (sender_id, series)
+            (sender_id, series), row_factory="dict", primary=True
         )
         return str(result['next_num']).zfill(8) if result else "00000001"
 
@@ -142,53 +276,152 @@ class Repository:
                        inv_type: str, series: str, number: str, date: str,
                        subtotal: float, igv: float, total: float,
                        status: str = "BORRADOR", items: List[Dict] = None,
-                       referenced_invoice_id: str = None, credit_note_reason: str = None) -> Optional[str]:
-        invoice_id = str(uuid.uuid4())
-        success = self.db.execute("""
-            INSERT INTO invoices (id, sender_id, client_id, client_name, type, series, number, date,
-                                  subtotal, igv, total, status, referenced_invoice_id, credit_note_reason)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (invoice_id, sender_id, client_id, client_name, inv_type, series, number, date,
-              subtotal, igv, total, status, referenced_invoice_id, credit_note_reason))
-
-        if success and items:
-            for item in items:
-                self.create_invoice_item(invoice_id, **item)
-
-        return invoice_id if success else None
-
-    def update_invoice_status(self, invoice_id: str, status: str,
-                              external_id: str = None, pdf_url: str = None,
-                              xml_url: str = None, sunat_response: str = None) -> bool:
+                       referenced_invoice_id: str = None, credit_note_reason: str = None,
+                       validate: bool = False) -> Optional[str]:
+        if validate:
+            # Chequeo previo: totales, IGV y aritmética de items
+            issues = check_invoice(subtotal, igv, total, items)
+            if issues:
+                print(f"❌ Comprobante inconsistente: {', '.join(i['check'] for i in issues)}")
+                return None
+
+        try:
+            # Cabecera + items en un solo commit
+            with self.db.transaction():
+                if inv_type == "NOTA_CREDITO" and referenced_invoice_id:
+                    remaining = self._lock_remaining_balance(referenced_invoice_id)
+                    if remaining is None or total > remaining + 0.005:
+                        print(f"❌ La nota de crédito ({total}) excede el saldo del comprobante ({remaining})")
+                        raise ValueError("Nota de crédito excede el saldo")
+                invoice_id = self.db.execute_returning("""
+                    INSERT INTO invoices (sender_id, client_id, client_name, type, series, number, date,
+                                          subtotal, igv, total, status, referenced_invoice_id, credit_note_reason)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id
+                """, (sender_id, client_id, client_name, inv_type, series, number, date,
+                      subtotal, igv, total, status, referenced_invoice_id, credit_note_reason))['id']
+                if items:
+                    self.db.execute_many(INSERT_INVOICE_ITEM,
+                                         [self._item_params(invoice_id, **item) for item in items])
+        except Exception:
+            return None
+
+        return invoice_id
+
+    def _lock_remaining_balance(self, invoice_id: str) -> Optional[float]:
+        """Bloquea el comprobante referenciado y retorna su saldo (usa idx_invoices_referenced)"""
+        # El lock va en su propia sentencia: en READ COMMITTED una sentencia toma su
+        # snapshot antes de esperar el lock y no vería la nota de crédito recién confirmada
+        invoice = self.db.fetch_one(
+            "SELECT total FROM invoices WHERE id = %s AND type <> 'NOTA_CREDITO' FOR UPDATE",
+            (invoice_id,), row_factory="dict", primary=True
+        )
+        if not invoice:
+            return None
+        row = self.db.fetch_one(f"""
+            SELECT COALESCE(SUM(total), 0) as credited FROM invoices
+            WHERE referenced_invoice_id = %s AND type = 'NOTA_CREDITO'
+              AND status NOT IN {VOID_STATUSES}
+        """, (invoice_id,), row_factory="dict", primary=True)
+        return float(invoice['total'] - row['credited'])
+
+    def get_invoice_balances(self, invoice_ids: Iterable[str] = None, sender_id: str = None) -> List[Dict]:
+        """
+        Monto neto y cobertura por notas de crédito de varios comprobantes en una query.
+
+        Args:
+            invoice_ids: Comprobantes a consultar
+            sender_id: O todos los comprobantes (no notas de crédito) de un sender
+
+        Returns:
+            Filas con total, credited, credit_notes, net_amount y coverage (0..1)
+        """
+        if invoice_ids is None and sender_id is None:
+            raise ValueError("Se requiere invoice_ids o sender_id")
+        filters, params = "", []
+        if invoice_ids is not None:
+            filters += " AND i.id = ANY(%s::bigint[])"
+            params.append(list(invoice_ids))
+        if sender_id:
+            filters += " AND i.sender_id = %s"
+            params.append(sender_id)
+        return self.db.fetch_all(f"""
+            SELECT
+                i.id, i.sender_id, i.type, i.series, i.number, i.date, i.status, i.total,
+                COALESCE(cn.credited, 0) as credited,
+                COALESCE(cn.credit_notes, 0) as credit_notes,
+                i.total - COALESCE(cn.credited, 0) as net_amount,
+                CASE WHEN i.total > 0 THEN COALESCE(cn.credited, 0) / i.total ELSE 0 END as coverage
+            FROM invoices i
+            LEFT JOIN LATERAL (
+                SELECT SUM(total) as credited, COUNT(*) as credit_notes
+                FROM invoices
+                WHERE referenced_invoice_id = i.id AND type = 'NOTA_CREDITO'
+                  AND status NOT IN {VOID_STATUSES}
+            ) cn ON TRUE
+            WHERE i.type <> 'NOTA_CREDITO'{filters}
+            ORDER BY i.date DESC, i.id DESC
+        """, params)
+
+    def update_invoice_status(self, invoice_id: str, status: str, task_id: str = None,
+                              pdf_base64: str = None, sunat_message: str = None) -> bool:
         return self.db.execute("""
-            UPDATE invoices SET status = %s, external_id = %s, pdf_url = %s, xml_url = %s, sunat_response = %s
+            UPDATE invoices SET status = %s, task_id = COALESCE(%s, task_id),
+                                pdf_base64 = COALESCE(%s, pdf_base64), sunat_message = COALESCE(%s, sunat_message)
             WHERE id = %s
-        """, (status, external_id, pdf_url, xml_url, sunat_response, invoice_id))
+        """, (status, task_id, pdf_base64, sunat_message, invoice_id))
 
     def delete_invoice(self, invoice_id: str) -> bool:
         return self.db.execute("DELETE FROM invoices WHERE id = %s", (invoice_id,))
 
+    def purge_invoice(self, invoice_id: str, batch_size: int = 1000, pause: float = 0.1,
+                      on_progress=None) -> PurgeJob:
+        """
+        Como purge_sender pero para un comprobante con muchos items.
+
+        Los comprobantes no tienen marca de borrado: mientras el job corre,
+        get_invoice_by_id puede devolver la cabecera con parte de sus items.
+        Usarlo con comprobantes que ya no se consultan (ej. borradores descartados).
+        Lanza ValueError si alguna nota de crédito referencia al comprobante.
+        """
+        references = self.db.fetch_one(INVOICE_REFERENCES_SQL, {"id": invoice_id}, row_factory="dict", primary=True)
+        if references is None:
+            raise self.db.last_error
+        if references["count"]:
+            raise ValueError(f"El comprobante {invoice_id} tiene {references['count']} notas de crédito que lo referencian")
+        job = PurgeJob("invoice", invoice_id, self.db.dsn, batch_size, pause, on_progress)
+        job.start()
+        return job
+
     # ==================== INVOICE ITEMS ====================
     def get_invoice_items(self, invoice_id: str) -> List[Dict]:
         return self.db.fetch_all("SELECT * FROM invoice_items WHERE invoice_id = %s", (invoice_id,))
 
+    @staticmethod
+    def _item_params(invoice_id: str, product_id: str = None, description: str = "",
+                     quantity: float = 1, unit: str = "UNIDAD", unit_price: float = 0,
+                     has_igv: bool = True, total: float = 0) -> tuple:
+        return (invoice_id, product_id, description, quantity, unit, unit_price, has_igv, total)
+
     def create_invoice_item(self, invoice_id: str, product_id: str = None, description: str = "",
                             quantity: float = 1, unit: str = "UNIDAD", unit_price: float = 0,
                             has_igv: bool = True, total: float = 0) -> bool:
-        return self.db.execute("""
-            INSERT INTO invoice_items (invoice_id, product_id, description, quantity, unit, unit_price, has_igv, total)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (invoice_id, product_id, description, quantity, unit, unit_price, has_igv, total))
+        return self.db.execute(INSERT_INVOICE_ITEM, self._item_params(
+            invoice_id, product_id, description, quantity, unit, unit_price, has_igv, total))
 
     # ==================== REPORTES ====================
-    def get_sales_by_month(self, sender_id: str, year: int = None) -> List[Dict]:
+    def get_sales_by_month(self, sender_id: str, year: int = None, primary: bool = None) -> List[Dict]:
         """Ventas agrupadas por mes para reportes"""
         query = """
             SELECT
                 DATE_TRUNC('month', date) as month,
-                COUNT(*) as total_invoices,
+                COUNT(*) FILTER (WHERE type <> 'NOTA_CREDITO') as total_invoices,
+                COUNT(*) FILTER (WHERE type = 'NOTA_CREDITO') as credit_note_count,
                 SUM(total) as total_sales,
-                SUM(igv) as total_igv
+                SUM(igv) as total_igv,
+                COALESCE(SUM(total) FILTER (WHERE type = 'NOTA_CREDITO'), 0) as total_credit_notes,
+                SUM(CASE WHEN type = 'NOTA_CREDITO' THEN -total ELSE total END) as net_sales,
+                SUM(CASE WHEN type = 'NOTA_CREDITO' THEN -igv ELSE igv END) as net_igv
             FROM invoices
             WHERE sender_id = %s AND status = 'ACEPTADO'
         """
@@ -197,9 +430,9 @@ class Repository:
             query += " AND EXTRACT(YEAR FROM date) = %s"
             params.append(year)
         query += " GROUP BY DATE_TRUNC('month', date) ORDER BY month DESC"
-        return self.db.fetch_all(query, params)
+        return self.db.fetch_all(query, params, primary=primary)
 
-    def get_top_products(self, sender_id: str, limit: int = 10) -> List[Dict]:
+    def get_top_products(self, sender_id: str, limit: int = 10, primary: bool = None) -> List[Dict]:
         """Productos más vendidos"""
         return self.db.fetch_all("""
             SELECT
@@ -212,7 +445,148 @@ class Repository:
             GROUP BY ii.description
             ORDER BY total_sales DESC
             LIMIT %s
-        """, (sender_id, limit))
+        """, (sender_id, limit), primary=primary)
+
+    # ==================== REPORTES MULTI-EMPRESA (ADMIN) ====================
+    @staticmethod
+    def _report_filters(sender_ids: Iterable[str] = None, date_from: str = None,
+                        date_to: str = None, alias: str = "i") -> Tuple[str, list]:
+        """Filtro común: sender_ids=None significa todas las empresas"""
+        query = ""
+        params = []
+        if sender_ids is not None:
+            query += f" AND {alias}.sender_id = ANY(%s::bigint[])"
+            params.append(list(sender_ids))
+        else:
+            query += f" AND {alias}.sender_id IN (SELECT id FROM senders WHERE deleting_at IS NULL)"
+        if date_from:
+            query += f" AND {alias}.date >= %s"
+            params.append(date_from)
+        if date_to:
+            query += f" AND {alias}.date <= %s"
+            params.append(date_to)
+        return query, params
+
+    def get_sales_by_month_multi(self, sender_ids: Iterable[str] = None,
+                                 date_from: str = None, date_to: str = None) -> List[Dict]:
+        """Ventas por empresa y mes en una sola query"""
+        filters, params = self._report_filters(sender_ids, date_from, date_to)
+        return self.db.fetch_all(f"""
+            SELECT
+                i.sender_id,
+                DATE_TRUNC('month', i.date) as month,
+                COUNT(*) FILTER (WHERE i.type <> 'NOTA_CREDITO') as total_invoices,
+                COUNT(*) FILTER (WHERE i.type = 'NOTA_CREDITO') as credit_note_count,
+                SUM(i.total) as total_sales,
+                SUM(i.igv) as total_igv,
+                COALESCE(SUM(i.total) FILTER (WHERE i.type = 'NOTA_CREDITO'), 0) as total_credit_notes,
+                SUM(CASE WHEN i.type = 'NOTA_CREDITO' THEN -i.total ELSE i.total END) as net_sales,
+                SUM(CASE WHEN i.type = 'NOTA_CREDITO' THEN -i.igv ELSE i.igv END) as net_igv
+            FROM invoices i
+            WHERE i.status = 'ACEPTADO'{filters}
+            GROUP BY i.sender_id, DATE_TRUNC('month', i.date)
+            ORDER BY i.sender_id, month DESC
+        """, params)
+
+    def get_top_products_multi(self, sender_ids: Iterable[str] = None, limit: int = 10,
+                               date_from: str = None, date_to: str = None) -> List[Dict]:
+        """Top productos de cada empresa (limit por empresa) en una sola query"""
+        filters, params = self._report_filters(sender_ids, date_from, date_to)
+        return self.db.fetch_all(f"""
+            SELECT sender_id, description, total_quantity, total_sales
+            FROM (
+                SELECT
+                    i.sender_id,
+                    ii.description,
+                    SUM(ii.quantity) as total_quantity,
+                    SUM(ii.total) as total_sales,
+                    ROW_NUMBER() OVER (PARTITION BY i.sender_id ORDER BY SUM(ii.total) DESC) as rank
+                FROM invoice_items ii
+                JOIN invoices i ON ii.invoice_id = i.id
+                WHERE i.status = 'ACEPTADO'{filters}
+                GROUP BY i.sender_id, ii.description
+            ) ranked
+            WHERE rank <= %s
+            ORDER BY sender_id, total_sales DESC
+        """, params + [limit])
+
+    def get_dashboard_summary(self, sender_ids: Iterable[str] = None,
+                              period: Tuple[str, str] = None, top_limit: int = 5) -> List[Dict]:
+        """
+        Resumen del dashboard admin en un solo round trip.
+
+        Args:
+            sender_ids: Empresas a incluir (None = todas)
+            period: Tupla (fecha_desde, fecha_hasta) en formato YYYY-MM-DD, ambos opcionales
+            top_limit: Cantidad de productos top por empresa
+
+        Returns:
+            Una fila por empresa con invoice_count, total_sales, total_igv,
+            total_credit_notes, net_sales, net_igv, status_breakdown (json) y top_products (json)
+        """
+        date_from, date_to = period if period else (None, None)
+        filters, params = self._report_filters(sender_ids, date_from, date_to)
+        return self.db.fetch_all(f"""
+            WITH scoped AS (
+                SELECT i.id, i.sender_id, i.type, i.status, i.total, i.igv
+                FROM invoices i
+                WHERE 1=1{filters}
+            ),
+            totals AS (
+                SELECT
+                    sender_id,
+                    COUNT(*) as invoice_count,
+                    COALESCE(SUM(total) FILTER (WHERE status = 'ACEPTADO'), 0) as total_sales,
+                    COALESCE(SUM(igv) FILTER (WHERE status = 'ACEPTADO'), 0) as total_igv,
+                    COALESCE(SUM(total) FILTER (WHERE status = 'ACEPTADO' AND type = 'NOTA_CREDITO'), 0) as total_credit_notes,
+                    COALESCE(SUM(CASE WHEN type = 'NOTA_CREDITO' THEN -total ELSE total END)
+                             FILTER (WHERE status = 'ACEPTADO'), 0) as net_sales,
+                    COALESCE(SUM(CASE WHEN type = 'NOTA_CREDITO' THEN -igv ELSE igv END)
+                             FILTER (WHERE status = 'ACEPTADO'), 0) as net_igv
+                FROM scoped
+                GROUP BY sender_id
+            ),
+            by_status AS (
+                SELECT sender_id, json_object_agg(status, count) as status_breakdown
+                FROM (SELECT sender_id, status, COUNT(*) as count FROM scoped GROUP BY sender_id, status) s
+                GROUP BY sender_id
+            ),
+            top AS (
+                SELECT sender_id, json_agg(json_build_object(
+                    'description', description,
+                    'total_quantity', total_quantity,
+                    'total_sales', total_sales
+                ) ORDER BY total_sales DESC) as top_products
+                FROM (
+                    SELECT
+                        s.sender_id,
+                        ii.description,
+                        SUM(ii.quantity) as total_quantity,
+                        SUM(ii.total) as total_sales,
+                        ROW_NUMBER() OVER (PARTITION BY s.sender_id ORDER BY SUM(ii.total) DESC) as rank
+                    FROM scoped s
+                    JOIN invoice_items ii ON ii.invoice_id = s.id
+                    WHERE s.status = 'ACEPTADO'
+                    GROUP BY s.sender_id, ii.description
+                ) ranked
+                WHERE rank <= %s
+                GROUP BY sender_id
+            )
+            SELECT
+                t.sender_id,
+                t.invoice_count,
+                t.total_sales,
+                t.total_igv,
+                t.total_credit_notes,
+                t.net_sales,
+                t.net_igv,
+                COALESCE(bs.status_breakdown, '{{}}'::json) as status_breakdown,
+                COALESCE(tp.top_products, '[]'::json) as top_products
+            FROM totals t
+            LEFT JOIN by_status bs ON bs.sender_id = t.sender_id
+            LEFT JOIN top tp ON tp.sender_id = t.sender_id
+            ORDER BY t.net_sales DESC
+        """, params + [top_limit])
 
 
 if __name__ == "__main__":
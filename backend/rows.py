@@ -0,0 +1,118 @@
+# rows.py - Representaciones compactas de filas (alternativa a RealDictCursor)
+from dataclasses import dataclass, fields
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional
+
+
+@dataclass(slots=True)
+class Sender:
+    id: int
+    user_id: Optional[str] = None
+    name: str = ""
+    ruc: str = ""
+    sunat_user_encrypted: Optional[str] = None
+    sunat_pass_encrypted: Optional[str] = None
+    deleting_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+@dataclass(slots=True)
+class Client:
+    id: int
+    sender_id: int = None
+    name: str = ""
+    dni: Optional[str] = None
+    ruc: Optional[str] = None
+    phone: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+@dataclass(slots=True)
+class Product:
+    id: int
+    sender_id: int = None
+    description: str = ""
+    unit: str = "UNIDAD"
+    base_price: Decimal = Decimal("0")
+    has_igv: bool = True
+    stock: int = 0
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+@dataclass(slots=True)
+class Invoice:
+    id: int
+    sender_id: int = None
+    client_id: Optional[int] = None
+    client_name: Optional[str] = None
+    client_document: Optional[str] = None
+    type: str = ""
+    series: str = ""
+    number: str = ""
+    date: Optional[date] = None
+    subtotal: Decimal = Decimal("0")
+    igv: Decimal = Decimal("0")
+    total: Decimal = Decimal("0")
+    status: str = "BORRADOR"
+    task_id: Optional[str] = None
+    pdf_base64: Optional[str] = None
+    sunat_message: Optional[str] = None
+    referenced_invoice_id: Optional[int] = None
+    credit_note_reason: Optional[str] = None
+    credit_note_sustento: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+@dataclass(slots=True)
+class InvoiceItem:
+    id: int
+    invoice_id: int = None
+    product_id: Optional[int] = None
+    description: str = ""
+    quantity: Decimal = Decimal("1")
+    unit: str = "UNIDAD"
+    unit_price: Decimal = Decimal("0")
+    has_igv: bool = True
+    total: Decimal = Decimal("0")
+    created_at: Optional[datetime] = None
+
+
+# Clase de cada tabla, para elegir el row_factory de una llamada (ej. ROW_CLASSES["products"])
+ROW_CLASSES = {
+    "senders": Sender,
+    "clients": Client,
+    "products": Product,
+    "invoices": Invoice,
+    "invoice_items": InvoiceItem,
+}
+
+_FIELD_NAMES = {cls: frozenset(f.name for f in fields(cls)) for cls in ROW_CLASSES.values()}
+
+
+def row_builder(cls, columns: list):
+    """
+    Devuelve una función tupla → instancia de `cls`.
+
+    Se calcula una sola vez por query qué columnas del cursor van a qué campo;
+    las columnas que la clase no conoce se ignoran.
+    """
+    field_order = [f.name for f in fields(cls)]
+    columns = list(columns)
+    # SELECT * sobre la tabla: mismas columnas en el mismo orden → constructor posicional
+    if columns == field_order[:len(columns)]:
+        return lambda row: cls(*row)
+    names = _FIELD_NAMES.get(cls) or frozenset(field_order)
+    positions = [(i, c) for i, c in enumerate(columns) if c in names]
+    return lambda row: cls(**{c: row[i] for i, c in positions})
+
+
+def to_columns(columns: list, rows: list) -> dict:
+    """Resultado columnar: {columna: [valores...]} para analítica"""
+    if not rows:
+        return {c: [] for c in columns}
+    return {c: list(values) for c, values in zip(columns, zip(*rows))}
@@ -0,0 +1,134 @@
+# sender_cache.py - Cache LRU/TTL de senders por id y RUC con credenciales SUNAT de vida corta
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Callable
+
+# Campos que solo viven en memoria mientras dura credentials_ttl
+CREDENTIAL_FIELDS = ("sunat_user", "sunat_pass")
+
+
+class SenderCache:
+    """
+    Cache acotado de filas de `senders`.
+
+    - Se indexa por id y por RUC (ambas claves apuntan a la misma entrada).
+    - Cada registro vence a los `ttl` segundos; las credenciales desencriptadas
+      vencen antes, a los `credentials_ttl` segundos, y se vuelven a desencriptar
+      desde los campos *_encrypted ya cacheados (sin ir a la BD). Cada operación
+      sobre el cache borra las credenciales vencidas de todas las entradas, no
+      solo de la que se lee.
+    - `observe` descarta entradas cuyo updated_at quedó viejo, pero solo se llama
+      desde get_senders. El frontend escribe senders directo en Supabase, así que
+      un get por id / RUC puede servir datos de hasta `ttl` segundos de antigüedad;
+      por eso el ttl por defecto es corto.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60, credentials_ttl: float = 30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.credentials_ttl = credentials_ttl
+        self._by_id: "OrderedDict[str, Dict]" = OrderedDict()
+        self._ruc_to_id: Dict[str, str] = {}
+        # Entradas con credenciales en claro, en orden de desencriptado
+        self._decrypted: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def get(self, sender_id=None, ruc: str = None,
+            decrypt: Callable[[Optional[str]], Optional[str]] = None) -> Optional[Dict]:
+        """Retorna una copia del sender (con credenciales) o None si no está o venció"""
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            key = str(sender_id) if sender_id is not None else self._ruc_to_id.get(ruc)
+            entry = self._by_id.get(key) if key else None
+            if entry is None:
+                return None
+            if now - entry["cached_at"] > self.ttl:
+                self._remove(key)
+                return None
+            self._by_id.move_to_end(key)
+
+            sender = entry["sender"]
+            needs_credentials = entry["credentials_at"] is None
+            result = dict(sender)
+
+        if needs_credentials and decrypt:
+            # Fuera del lock: la derivación de clave no bloquea a otros lectores
+            credentials = {
+                "sunat_user": decrypt(sender.get("sunat_user_encrypted")),
+                "sunat_pass": decrypt(sender.get("sunat_pass_encrypted")),
+            }
+            result.update(credentials)
+            with self._lock:
+                if self._by_id.get(key) is entry:
+                    sender.update(credentials)
+                    self._mark_decrypted(key, entry, time.monotonic())
+        return result
+
+    def put(self, sender: Dict):
+        """Guarda una fila de senders (con credenciales ya desencriptadas si las trae)"""
+        key = str(sender["id"])
+        now = time.monotonic()
+        has_credentials = all(field in sender for field in CREDENTIAL_FIELDS)
+        with self._lock:
+            self._sweep(now)
+            self._remove(key)
+            entry = {"sender": dict(sender), "cached_at": now, "credentials_at": None}
+            self._by_id[key] = entry
+            if has_credentials:
+                self._mark_decrypted(key, entry, now)
+            self._ruc_to_id[sender["ruc"]] = key
+            while len(self._by_id) > self.max_size:
+                self._remove(next(iter(self._by_id)))
+
+    def invalidate(self, sender_id=None, ruc: str = None):
+        with self._lock:
+            self._sweep(time.monotonic())
+            key = str(sender_id) if sender_id is not None else self._ruc_to_id.get(ruc)
+            if key:
+                self._remove(key)
+
+    def observe(self, sender: Dict):
+        """Invalida la entrada si la fila leída tiene otro updated_at"""
+        key = str(sender["id"])
+        with self._lock:
+            self._sweep(time.monotonic())
+            entry = self._by_id.get(key)
+            if entry and entry["sender"].get("updated_at") != sender.get("updated_at"):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._ruc_to_id.clear()
+            self._decrypted.clear()
+
+    def _mark_decrypted(self, key: str, entry: Dict, now: float):
+        entry["credentials_at"] = now
+        self._decrypted.pop(key, None)
+        self._decrypted[key] = now
+
+    def _sweep(self, now: float):
+        """Borra las credenciales en claro vencidas (las más viejas están al inicio)"""
+        while self._decrypted:
+            key, decrypted_at = next(iter(self._decrypted.items()))
+            if now - decrypted_at <= self.credentials_ttl:
+                break
+            del self._decrypted[key]
+            entry = self._by_id.get(key)
+            if entry:
+                for field in CREDENTIAL_FIELDS:
+                    entry["sender"].pop(field, None)
+                entry["credentials_at"] = None
+
+    def _remove(self, key: str):
+        self._decrypted.pop(key, None)
+        entry = self._by_id.pop(key, None)
+        if entry:
+            ruc = entry["sender"].get("ruc")
+            if self._ruc_to_id.get(ruc) == key:
+                del self._ruc_to_id[ruc]
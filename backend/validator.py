@@ -0,0 +1,196 @@
+# validator.py - Validación de totales, IGV y aritmética de items de los comprobantes
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Optional, List, Dict, Iterator
+
+from psycopg2.extras import RealDictCursor
+
+from connection import Database
+
+IGV_RATE = Decimal("0.18")
+CENT = Decimal("0.01")
+# Tolerancia base por comparación y error máximo por redondear unit_price a 2 decimales
+TOLERANCE = Decimal("0.01")
+UNIT_PRICE_ROUNDING = Decimal("0.005")
+
+# Agregados por comprobante calculados en el servidor: los items no viajan a Python
+AGGREGATE_QUERY = """
+    SELECT
+        i.id, i.sender_id, i.series, i.number, i.date,
+        i.subtotal, i.igv, i.total,
+        COUNT(ii.id) as item_count,
+        COALESCE(SUM(ii.total), 0) as items_total,
+        COALESCE(SUM(ii.quantity * ii.unit_price) FILTER (WHERE ii.has_igv), 0) as gravada,
+        COALESCE(SUM(ii.quantity * ii.unit_price) FILTER (WHERE NOT ii.has_igv), 0) as exonerada,
+        COALESCE(SUM(ii.quantity) FILTER (WHERE ii.has_igv), 0) as gravada_quantity,
+        COALESCE(SUM(ii.quantity), 0) as total_quantity,
+        ARRAY_REMOVE(ARRAY_AGG(ii.id) FILTER (WHERE
+            ABS(ii.total - ii.quantity * ii.unit_price * CASE WHEN ii.has_igv THEN 1.18 ELSE 1 END)
+            > %(tolerance)s + %(rounding)s * ii.quantity * CASE WHEN ii.has_igv THEN 1.18 ELSE 1 END
+        ), NULL) as bad_item_ids
+    FROM invoices i
+    LEFT JOIN invoice_items ii ON ii.invoice_id = i.id
+    WHERE 1=1{filters}
+    GROUP BY i.id
+    ORDER BY i.id
+"""
+
+
+def _money(value) -> Decimal:
+    return Decimal(str(value or 0)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _dec(value) -> Decimal:
+    return Decimal(str(value or 0))
+
+
+def find_discrepancies(row: Dict) -> List[Dict]:
+    """
+    Compara la cabecera de un comprobante contra los agregados de sus items.
+
+    `row` trae subtotal, igv, total y los agregados de AGGREGATE_QUERY
+    (item_count, items_total, gravada, exonerada, gravada_quantity,
+    total_quantity, bad_item_ids).
+    """
+    subtotal, igv, total = _dec(row["subtotal"]), _dec(row["igv"]), _dec(row["total"])
+    issues = []
+
+    if abs(subtotal + igv - total) > TOLERANCE:
+        issues.append({"check": "HEADER_SUM", "expected": _money(subtotal + igv), "actual": total})
+
+    if not row["item_count"]:
+        return issues
+
+    if row["bad_item_ids"]:
+        issues.append({"check": "LINE_TOTAL", "item_ids": list(row["bad_item_ids"])})
+
+    gravada, exonerada = _dec(row["gravada"]), _dec(row["exonerada"])
+    rounding = UNIT_PRICE_ROUNDING * _dec(row["total_quantity"])
+
+    expected_igv = _money(gravada * IGV_RATE)
+    if abs(expected_igv - igv) > TOLERANCE + UNIT_PRICE_ROUNDING * _dec(row["gravada_quantity"]) * IGV_RATE:
+        issues.append({"check": "IGV", "expected": expected_igv, "actual": igv})
+
+    expected_subtotal = _money(gravada + exonerada)
+    if abs(expected_subtotal - subtotal) > TOLERANCE + rounding:
+        issues.append({"check": "SUBTOTAL", "expected": expected_subtotal, "actual": subtotal})
+
+    items_total = _dec(row["items_total"])
+    if abs(items_total - total) > TOLERANCE * row["item_count"]:
+        issues.append({"check": "ITEMS_TOTAL", "expected": items_total, "actual": total})
+
+    return issues
+
+
+def aggregate_items(items: List[Dict]) -> Dict:
+    """Los mismos agregados que AGGREGATE_QUERY para items que aún no están en la BD"""
+    agg = {"item_count": len(items), "items_total": Decimal(0), "gravada": Decimal(0),
+           "exonerada": Decimal(0), "gravada_quantity": Decimal(0), "total_quantity": Decimal(0),
+           "bad_item_ids": []}
+    for position, item in enumerate(items):
+        quantity, unit_price = _dec(item.get("quantity", 1)), _dec(item.get("unit_price"))
+        has_igv = item.get("has_igv", True)
+        factor = 1 + IGV_RATE if has_igv else Decimal(1)
+        base = quantity * unit_price
+        line_total = _dec(item.get("total"))
+
+        agg["items_total"] += line_total
+        agg["total_quantity"] += quantity
+        if has_igv:
+            agg["gravada"] += base
+            agg["gravada_quantity"] += quantity
+        else:
+            agg["exonerada"] += base
+        if abs(line_total - base * factor) > TOLERANCE + UNIT_PRICE_ROUNDING * quantity * factor:
+            agg["bad_item_ids"].append(position)
+    return agg
+
+
+def check_invoice(subtotal: float, igv: float, total: float, items: List[Dict] = None) -> List[Dict]:
+    """Chequeo previo al insert (create_invoice). En LINE_TOTAL los ids son posiciones en `items`"""
+    row = {"subtotal": subtotal, "igv": igv, "total": total}
+    row.update(aggregate_items(items or []))
+    return find_discrepancies(row)
+
+
+class InvoiceValidator:
+    """
+    Valida en bloque los comprobantes guardados.
+
+    Postgres recalcula los agregados de items por comprobante y el resultado se
+    lee por lotes con un cursor del lado del servidor, así que la memoria usada
+    no depende de la cantidad de items.
+    """
+
+    def __init__(self, db: Database = None, batch_size: int = 5000):
+        self.db = db or Database()
+        if self.db.conn is None:
+            self.db.connect()
+        self.batch_size = batch_size
+
+    def iter_discrepancies(self, sender_id: str = None, date_from: str = None,
+                           date_to: str = None) -> Iterator[Dict]:
+        """Genera un dict por comprobante con discrepancias"""
+        filters = ""
+        params = {"tolerance": TOLERANCE, "rounding": UNIT_PRICE_ROUNDING}
+        if sender_id:
+            filters += " AND i.sender_id = %(sender_id)s"
+            params["sender_id"] = sender_id
+        if date_from:
+            filters += " AND i.date >= %(date_from)s"
+            params["date_from"] = date_from
+        if date_to:
+            filters += " AND i.date <= %(date_to)s"
+            params["date_to"] = date_to
+
+        # Dentro de un repo.transaction() el cursor vive en la transacción del llamador:
+        # al terminar solo se cierra, sin rollback que descarte su unit of work
+        owns_transaction = not self.db.in_transaction
+        cur = self.db.conn.cursor(name="invoice_validator", cursor_factory=RealDictCursor)
+        cur.itersize = self.batch_size
+        try:
+            cur.execute(AGGREGATE_QUERY.format(filters=filters), params)
+            while True:
+                batch = cur.fetchmany(self.batch_size)
+                if not batch:
+                    break
+                for row in batch:
+                    issues = find_discrepancies(row)
+                    if issues:
+                        yield {
+                            "invoice_id": row["id"],
+                            "sender_id": row["sender_id"],
+                            "document": f"{row['series']}-{row['number']}",
+                            "date": row["date"],
+                            "issues": issues,
+                        }
+        finally:
+            cur.close()
+            if owns_transaction:
+                self.db.conn.rollback()
+
+    def validate(self, sender_id: str = None, date_from: str = None,
+                 date_to: str = None, limit: Optional[int] = None) -> List[Dict]:
+        """Lista de comprobantes con discrepancias (hasta `limit`)"""
+        results = []
+        for discrepancy in self.iter_discrepancies(sender_id, date_from, date_to):
+            results.append(discrepancy)
+            if limit and len(results) >= limit:
+                break
+        return results
+
+
+if __name__ == "__main__":
+    import sys
+
+    validator = InvoiceValidator()
+    sender = sys.argv[1] if len(sys.argv) > 1 else None
+    print(f"\n🔍 Validando comprobantes{' del sender ' + sender if sender else ''}...")
+    print("=" * 50)
+    count = 0
+    for d in validator.iter_discrepancies(sender):
+        count += 1
+        checks = ", ".join(i["check"] for i in d["issues"])
+        print(f"   ✗ {d['document']} ({d['date']}): {checks}")
+    print("=" * 50)
+    print(f"{'✅ Sin discrepancias' if not count else f'⚠️  {count} comprobantes con discrepancias'}")
+    validator.db.close()